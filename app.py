@@ -1,10 +1,24 @@
 import streamlit as st
-import os
-from markitdown import MarkItDown
-from openai import AzureOpenAI
-import tempfile
+import time
 import html
+import uuid
 from prompts import get_business_canvas_prompt, get_value_proposition_prompt
+from conversion import SUPPORTED_TYPES, get_cache as get_conversion_cache
+from jobs import submit_conversion, DONE, FAILED, RUNNING
+from ingest import MAX_UPLOAD_MB, read_blocks
+from lazy_pages import section_page
+from clients import get_client, warm_up
+from llm import ChatStream, completion, cached_completion, get_response_cache, run_async, stream_options, usage_stats
+from retrieval import RetrievalIndex
+from doc_store import DocumentStore, process_usage
+from preview import PreviewCache, FILES_PER_PAGE, file_type
+from context import CALL_SITES, DocumentContext, assemble_context
+from html_stream import HtmlStream, strip_code_fences
+from chat_history import ChatHistory
+from document_names import DocumentNames, content_digest
+from startup import prewarm
+from rate_limit import get_scheduler
+import metrics
 
 st.set_page_config(
     page_title="IndieApp Demo",
@@ -14,25 +28,156 @@ st.set_page_config(
 
 def init_session_state():
     if 'uploaded_files_content' not in st.session_state:
-        st.session_state.uploaded_files_content = {}
-    if 'deleted_files' not in st.session_state:
-        st.session_state.deleted_files = set()
-    if 'azure_client' not in st.session_state:
-        st.session_state.azure_client = None
+        st.session_state.uploaded_files_content = DocumentStore()
+    if 'document_names' not in st.session_state:
+        st.session_state.document_names = DocumentNames()
+    # Content hash of every upload already queued, stored or aliased, by upload id, so
+    # files still listed in the uploader are not added back after being deleted
+    if 'handled_uploads' not in st.session_state:
+        st.session_state.handled_uploads = {}
+    if 'retrieval_index' not in st.session_state:
+        st.session_state.retrieval_index = RetrievalIndex()
+    if 'document_context' not in st.session_state:
+        st.session_state.document_context = DocumentContext(st.session_state.uploaded_files_content)
+    if 'preview_cache' not in st.session_state:
+        st.session_state.preview_cache = PreviewCache()
+    if 'conversion_jobs' not in st.session_state:
+        st.session_state.conversion_jobs = {}
+    if 'lazy_documents' not in st.session_state:
+        st.session_state.lazy_documents = {}
+    if 'generated_artifacts' not in st.session_state:
+        st.session_state.generated_artifacts = {}
+    # Sessions take turns in the model request queue
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
 
-def get_azure_client():
-    if st.session_state.azure_client is None:
-        endpoint = st.session_state.get('azure_endpoint', '')
-        api_key = st.session_state.get('azure_api_key', '')
-        api_version = st.session_state.get('azure_api_version', '2024-02-01')
-        
-        if endpoint and api_key:
-            st.session_state.azure_client = AzureOpenAI(
-                azure_endpoint=endpoint,
-                api_key=api_key,
-                api_version=api_version
-            )
-    return st.session_state.azure_client
+def add_file(filename, content):
+    st.session_state.uploaded_files_content[filename] = content
+    st.session_state.preview_cache.invalidate(filename)
+    st.session_state.document_context.invalidate(filename)
+    st.session_state.retrieval_index.add_document(filename, content)
+
+def add_file_from_path(filename, path):
+    # Large conversions are loaded a block at a time, so the whole markdown is never in memory at once
+    store = st.session_state.uploaded_files_content
+    if filename in store:
+        del store[filename]
+    st.session_state.retrieval_index.remove_document(filename)
+    offset = 0
+    for block in read_blocks(path):
+        store.append(filename, block)
+        st.session_state.retrieval_index.extend_document(filename, block, offset)
+        offset += len(block)
+    if filename not in store:
+        store[filename] = ""
+    st.session_state.preview_cache.invalidate(filename)
+    st.session_state.document_context.invalidate(filename)
+
+def materialize_pages(filename, numbers=None):
+    """Convert pages of a lazily converted document and refresh it everywhere. Returns whether any were converted."""
+    document = st.session_state.lazy_documents.get(filename)
+    if document is None or not document.missing(numbers):
+        return False
+    
+    converted_before = document.converted_count
+    progress = st.progress(converted_before / document.page_count, text=f"Converting {filename}...") if numbers is None else None
+    
+    def on_progress(converted):
+        if progress is not None:
+            progress.progress(converted / document.page_count, text=f"Converting {filename}: {converted} of {document.page_count} pages")
+    
+    try:
+        document.materialize(st.session_state.uploaded_files_content, st.session_state.retrieval_index, numbers, on_progress=on_progress)
+    except Exception as e:
+        st.error(f"Error converting pages of {filename}: {str(e)}")
+    finally:
+        if progress is not None:
+            progress.empty()
+    
+    if document.converted_count == converted_before:
+        return False
+    # The new pages are already stored and indexed
+    st.session_state.preview_cache.invalidate(filename)
+    st.session_state.document_context.invalidate(filename)
+    return True
+
+def delete_file(filename):
+    st.session_state.document_names.remove(filename)
+    lazy_document = st.session_state.lazy_documents.pop(filename, None)
+    if lazy_document is not None:
+        lazy_document.discard()
+    del st.session_state.uploaded_files_content[filename]
+    st.session_state.retrieval_index.remove_document(filename)
+    st.session_state.preview_cache.invalidate(filename)
+    st.session_state.document_context.invalidate(filename)
+
+def clear_files():
+    # Conversions still in flight are never collected
+    for job in st.session_state.conversion_jobs.values():
+        job.discard()
+    st.session_state.conversion_jobs.clear()
+    for lazy_document in st.session_state.lazy_documents.values():
+        lazy_document.discard()
+    st.session_state.lazy_documents.clear()
+    st.session_state.document_names.clear()
+    st.session_state.uploaded_files_content.clear()
+    st.session_state.retrieval_index.clear()
+    st.session_state.preview_cache.invalidate()
+    st.session_state.document_context.invalidate()
+
+def collect_conversions():
+    """Move finished background conversions into the session's documents."""
+    collected = False
+    for key, job in list(st.session_state.conversion_jobs.items()):
+        if job.state == DONE:
+            del st.session_state.conversion_jobs[key]
+            if job.document is not None:
+                # Only the page list is known so far; pages convert when first needed
+                st.session_state.lazy_documents[job.filename] = job.document
+                add_file(job.filename, job.document.outline())
+            elif job.markdown_path:
+                try:
+                    add_file_from_path(job.filename, job.markdown_path)
+                finally:
+                    job.discard()
+            else:
+                add_file(job.filename, job.markdown)
+            collected = True
+    return collected
+
+@st.fragment(run_every=1.0)
+def conversion_progress():
+    # Only this fragment reruns while files convert; the whole page reruns once one is done
+    if collect_conversions():
+        st.rerun()
+    
+    jobs = list(st.session_state.conversion_jobs.values())
+    pending = [job for job in jobs if job.pending]
+    if not pending:
+        st.rerun()
+    
+    finished = len(jobs) - len(pending)
+    st.progress(finished / len(jobs), text=f"Converting {len(pending)} files in the background - you can already chat with the finished ones")
+    for job in pending:
+        if job.state == RUNNING and job.streaming:
+            st.caption(f"⚙️ {job.filename} - converting page by page, {job.progress_bytes / 1024 / 1024:.1f} MB written in {time.time() - job.started_at:.0f}s")
+        elif job.state == RUNNING:
+            st.caption(f"⚙️ {job.filename} - converting for {time.time() - job.started_at:.0f}s")
+        else:
+            st.caption(f"⏳ {job.filename} - queued")
+
+def queue_message(position, paused_seconds):
+    if paused_seconds:
+        return f"⏳ The model is busy; retrying in {paused_seconds}s (position {position} in the queue)"
+    return f"⏳ Waiting for the model (position {position} in the queue)"
+
+def get_azure_client(asynchronous=False):
+    return get_client(
+        st.session_state.get('azure_endpoint', ''),
+        st.session_state.get('azure_api_key', ''),
+        st.session_state.get('azure_api_version', '2024-02-01'),
+        asynchronous=asynchronous
+    )
 
 def file_upload_page():
     st.title("📁 File Upload & Preview")
@@ -50,104 +195,103 @@ def file_upload_page():
     """, unsafe_allow_html=True)
     
     uploaded_files = st.file_uploader(
-        "Upload files (max 10MB each)",
+        f"Upload files (max {MAX_UPLOAD_MB:g}MB each)",
         accept_multiple_files=True,
-        type=['pdf', 'docx', 'txt', 'md', 'xlsx', 'pptx', 'html', 'csv'],
+        type=SUPPORTED_TYPES,
         key="file_uploader"
     )
     
-    # Process new files
+    # Queue new files for conversion in the background
     if uploaded_files:
-        md = MarkItDown()
-        
         for uploaded_file in uploaded_files:
-            if uploaded_file.size > 10 * 1024 * 1024:  # 10MB limit
-                st.error(f"File {uploaded_file.name} exceeds 10MB limit")
+            if uploaded_file.size > MAX_UPLOAD_MB * 1024 * 1024:
+                st.error(f"File {uploaded_file.name} exceeds {MAX_UPLOAD_MB:g}MB limit")
                 continue
             
-            # Only process if not already processed AND not explicitly deleted
-            if (uploaded_file.name not in st.session_state.uploaded_files_content and 
-                uploaded_file.name not in st.session_state.deleted_files):
-                try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                        tmp_file.write(uploaded_file.getvalue())
-                        tmp_file_path = tmp_file.name
-                    
-                    result = md.convert(tmp_file_path)
-                    markdown_content = result.text_content
-                    
-                    st.session_state.uploaded_files_content[uploaded_file.name] = markdown_content
-                    
-                    os.unlink(tmp_file_path)
-                    
-                except Exception as e:
-                    st.error(f"Error processing {uploaded_file.name}: {str(e)}")
+            # Each upload is looked at once, even after its document is deleted
+            if uploaded_file.file_id in st.session_state.handled_uploads:
+                continue
+            data = uploaded_file.getvalue()
+            digest = content_digest(data)
+            st.session_state.handled_uploads[uploaded_file.file_id] = digest
+            
+            # Content that is already stored or converting only gains another name
+            document_names = st.session_state.document_names
+            name = document_names.document_for(digest)
+            if name is not None:
+                document_names.add_alias(name, uploaded_file.name)
+                continue
+            name = document_names.add(uploaded_file.name, digest)
+            st.session_state.conversion_jobs[digest] = submit_conversion(name, data)
+    
+    # Failed files are retried when they are uploaded again
+    current_uploads = {st.session_state.handled_uploads.get(uploaded_file.file_id) for uploaded_file in uploaded_files or []}
+    for key, job in list(st.session_state.conversion_jobs.items()):
+        if job.state == FAILED:
+            st.session_state.document_names.forget(key)
+            if key in current_uploads:
+                st.error(f"Error processing {job.filename}: {job.error}")
+            else:
+                del st.session_state.conversion_jobs[key]
+    
+    if any(job.pending for job in st.session_state.conversion_jobs.values()):
+        conversion_progress()
     
     # Display all processed files (persisted across page switches)
     if st.session_state.uploaded_files_content:
         st.success(f"📚 {len(st.session_state.uploaded_files_content)} files processed and ready for AI chat")
+        usage = st.session_state.uploaded_files_content.usage()
+        st.caption(
+            f"💾 {usage['memory_bytes'] / 1024 / 1024:.1f} of {usage['budget_bytes'] / 1024 / 1024:.0f} MB in memory"
+            f" ({usage['compressed']} compressed), {usage['disk_bytes'] / 1024 / 1024:.1f} MB spilled to disk ({usage['spilled']} files)"
+        )
         
         # Add option to clear all files
         if st.button("🗑️ Clear All Files", type="secondary"):
-            st.session_state.deleted_files.update(st.session_state.uploaded_files_content.keys())
-            st.session_state.uploaded_files_content = {}
+            clear_files()
             st.rerun()
         
         st.subheader("📄 Processed Files Preview:")
         
         # Create a list of filenames to iterate over (to avoid dictionary changing during iteration)
         filenames = list(st.session_state.uploaded_files_content.keys())
+        preview_cache = st.session_state.preview_cache
         
-        for filename in filenames:
+        # Only one page of the file list is rendered per rerun
+        list_pages = (len(filenames) + FILES_PER_PAGE - 1) // FILES_PER_PAGE
+        list_page = 1
+        if list_pages > 1:
+            list_page = st.selectbox(
+                "Files page",
+                range(1, list_pages + 1),
+                format_func=lambda number: f"Files {(number - 1) * FILES_PER_PAGE + 1}-{min(number * FILES_PER_PAGE, len(filenames))} of {len(filenames)}",
+                key="preview_files_page"
+            )
+        
+        for filename in filenames[(list_page - 1) * FILES_PER_PAGE:list_page * FILES_PER_PAGE]:
             if filename not in st.session_state.uploaded_files_content:
                 continue  # Skip if file was deleted
                 
-            content = st.session_state.uploaded_files_content[filename]
+            # Get file extension, icon and colors
+            file_ext, config = file_type(filename)
+            stats = preview_cache.stats(filename, st.session_state.uploaded_files_content)
+            preview_pages = len(stats['offsets'])
+            # Lazily converted documents are previewed by their own pages, converted on demand
+            lazy_document = st.session_state.lazy_documents.get(filename)
+            pages_note = ""
+            if lazy_document is not None:
+                preview_pages = lazy_document.page_count
+                if not lazy_document.complete:
+                    pages_note = f" · {lazy_document.converted_count} of {lazy_document.page_count} pages converted"
             
-            # Get file extension and icon
-            file_ext = filename.split('.')[-1].upper() if '.' in filename else 'FILE'
-            
-            # Define file type colors and icons
-            file_type_config = {
-                'PDF': {'icon': '📕', 'color': '#dc3545', 'bg_color': '#f8d7da'},
-                'DOC': {'icon': '📘', 'color': '#0d6efd', 'bg_color': '#cce7ff'}, 
-                'DOCX': {'icon': '📘', 'color': '#0d6efd', 'bg_color': '#cce7ff'},
-                'TXT': {'icon': '📝', 'color': '#6c757d', 'bg_color': '#e9ecef'},
-                'MD': {'icon': '📝', 'color': '#6c757d', 'bg_color': '#e9ecef'},
-                'XLSX': {'icon': '📊', 'color': '#198754', 'bg_color': '#d1eddb'},
-                'XLS': {'icon': '📊', 'color': '#198754', 'bg_color': '#d1eddb'},
-                'CSV': {'icon': '📊', 'color': '#198754', 'bg_color': '#d1eddb'},
-                'PPTX': {'icon': '📈', 'color': '#fd7e14', 'bg_color': '#ffe5cc'},
-                'PPT': {'icon': '📈', 'color': '#fd7e14', 'bg_color': '#ffe5cc'},
-                'HTML': {'icon': '🌐', 'color': '#6610f2', 'bg_color': '#e0cffc'},
-                'HTM': {'icon': '🌐', 'color': '#6610f2', 'bg_color': '#e0cffc'},
-            }
-            
-            config = file_type_config.get(file_ext, {'icon': '📄', 'color': '#6c757d', 'bg_color': '#e9ecef'})
+            aliases = st.session_state.document_names.aliases(filename)
             
             # Create row with filename and delete button
             col1, col2 = st.columns([5, 1])
             
             with col1:
-                # Enhanced expander header with file type badge
-                expander_header = f"""
-                <div style="display: flex; align-items: center; gap: 8px;">
-                    <span style="font-size: 18px;">{config['icon']}</span>
-                    <span style="font-weight: 500;">{filename}</span>
-                    <span style="
-                        background-color: {config['bg_color']}; 
-                        color: {config['color']}; 
-                        padding: 2px 8px; 
-                        border-radius: 12px; 
-                        font-size: 11px; 
-                        font-weight: bold;
-                        border: 1px solid {config['color']}40;
-                    ">{file_ext}</span>
-                </div>
-                """
-                
-                # Use expander with enhanced header
-                with st.expander(f"{config['icon']} {filename}", expanded=False):
+                label = f"{config['icon']} {filename}" + (f" (+{len(aliases)} identical)" if aliases else "")
+                with st.expander(label, expanded=False):
                     # Show file type badge and stats at the top
                     st.markdown(
                         f"""
@@ -171,46 +315,69 @@ def file_upload_page():
                                     font-weight: bold;
                                 ">{file_ext}</span>
                                 <span style="font-size: 12px; color: #6c757d;">
-                                    {len(content):,} characters
+                                    {stats['chars']:,} characters{pages_note}
                                 </span>
                             </div>
                             <span style="font-size: 12px; color: #6c757d;">
-                                {round(len(content.encode('utf-8')) / 1024, 1)} KB
+                                {stats['kb']} KB
                             </span>
                         </div>
                         """,
                         unsafe_allow_html=True
                     )
+                    if aliases:
+                        st.caption(f"📎 Same content also uploaded as: {', '.join(aliases)} - converted and sent to the AI only once")
                     
-                    st.markdown("**Markdown Preview:**")
-                    
-                    # Create scrollable container for markdown content
-                    st.markdown(
-                        f"""
-                        <div style="
-                            max-height: 400px; 
-                            overflow-y: auto; 
-                            padding: 10px; 
-                            border: 1px solid #e0e0e0; 
-                            border-radius: 5px; 
-                            background-color: #f9f9f9;
-                            font-family: monospace;
-                            white-space: pre-wrap;
-                            font-size: 12px;
-                            line-height: 1.4;
-                        ">
-                        {html.escape(content)}
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
+                    # Expander bodies are always sent to the browser, so the
+                    # content itself is only rendered once it is asked for
+                    if st.toggle("Show markdown preview", key=f"show_preview_{filename}"):
+                        page = 1
+                        if preview_pages > 1:
+                            page = st.selectbox(
+                                "Page",
+                                range(1, preview_pages + 1),
+                                format_func=lambda number: f"Page {number} of {preview_pages}",
+                                key=f"preview_page_{filename}"
+                            )
+                        
+                        if lazy_document is None:
+                            fragment = preview_cache.page(filename, st.session_state.uploaded_files_content, page)
+                        else:
+                            if lazy_document.missing([page]):
+                                with st.spinner(f"Converting page {page}..."):
+                                    if materialize_pages(filename, [page]):
+                                        # Again, so the stats above include the new page
+                                        st.rerun()
+                            fragment = "" if lazy_document.missing([page]) else html.escape(lazy_document.page(st.session_state.uploaded_files_content, page))
+                        
+                        st.markdown("**Markdown Preview:**")
+                        
+                        # Create scrollable container for markdown content
+                        st.markdown(
+                            f"""
+                            <div style="
+                                max-height: 400px; 
+                                overflow-y: auto; 
+                                padding: 10px; 
+                                border: 1px solid #e0e0e0; 
+                                border-radius: 5px; 
+                                background-color: #f9f9f9;
+                                font-family: monospace;
+                                white-space: pre-wrap;
+                                font-size: 12px;
+                                line-height: 1.4;
+                            ">
+                            {fragment}
+                            </div>
+                            """,
+                            unsafe_allow_html=True
+                        )
             
             with col2:
                 # Delete button aligned with expander header
                 st.write("")  # Add some spacing to align with expander
                 if st.button("🗑️", key=f"delete_preview_{filename}", help=f"Delete {filename}"):
-                    st.session_state.deleted_files.add(filename)
-                    del st.session_state.uploaded_files_content[filename]
+                    delete_file(filename)
                     st.rerun()
     else:
         st.info("👆 Upload files above to get started")
@@ -232,8 +399,6 @@ def ai_chat_page():
         st.warning("Please set deployment name in Settings page.")
         return
     
-    context = "\n\n".join([f"File: {filename}\n{content}" for filename, content in st.session_state.uploaded_files_content.items()])
-    
     # Show compact context files summary
     with st.expander(f"📚 Context Files ({len(st.session_state.uploaded_files_content)} files) - Click to manage"):
         filenames = list(st.session_state.uploaded_files_content.keys())
@@ -246,41 +411,195 @@ def ai_chat_page():
                 st.write(f"📄 {filename}")
             with col2:
                 if st.button("🗑️", key=f"delete_chat_{filename}", help=f"Remove {filename} from context"):
-                    st.session_state.deleted_files.add(filename)
-                    del st.session_state.uploaded_files_content[filename]
+                    delete_file(filename)
                     st.rerun()
     
     if 'messages' not in st.session_state:
         st.session_state.messages = []
+    if 'chat_timings' not in st.session_state:
+        st.session_state.chat_timings = []
+    if 'chat_history' not in st.session_state:
+        st.session_state.chat_history = ChatHistory()
     
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
     
     if prompt := st.chat_input("Ask about your uploaded files..."):
+        # Earlier turns, with the oldest ones folded into a summary
+        history = st.session_state.chat_history.build(st.session_state.messages)
+        previous_questions = [message["content"] for message in st.session_state.messages if message["role"] == "user"]
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
         
         with st.chat_message("assistant"):
+            stop_area = st.empty()
+            response_area = st.empty()
+            stream = None
+            
+            # Send only the excerpts most relevant to this question; the previous
+            # question helps with follow-ups like "and what about pricing?"
+            query = " ".join(previous_questions[-1:] + [prompt])
+            # Without bookmarks or slide titles nothing tells which pages a question is
+            # about, so such documents are converted in full before their first search
+            for filename, lazy_document in list(st.session_state.lazy_documents.items()):
+                if not lazy_document.has_titles:
+                    materialize_pages(filename)
+            chunks = st.session_state.retrieval_index.search(query, st.session_state.uploaded_files_content)
+            # Pages of lazily converted documents only have their title until they are
+            # retrieved; convert the ones that matched and search again with their text
+            needed = {}
+            for chunk in chunks:
+                number = section_page(chunk.section)
+                if chunk.filename in st.session_state.lazy_documents and number is not None:
+                    needed.setdefault(chunk.filename, []).append(number)
+            converted = False
+            if needed:
+                with st.spinner("Converting the matching pages..."):
+                    for filename, numbers in needed.items():
+                        converted = materialize_pages(filename, numbers) or converted
+            if converted:
+                chunks = st.session_state.retrieval_index.search(query, st.session_state.uploaded_files_content)
+            # The instructions and earlier turns stay the same from turn to turn, so
+            # they form a prefix the provider can cache; the excerpts go last
+            instructions = "You are a helpful assistant. Answer questions about the user's uploaded files. Format your responses using markdown for better readability (use headers, bullet points, code blocks, etc. when appropriate). Each question comes with a set of numbered excerpts from the files; cite the excerpts you rely on by their number, e.g. [2]."
+            context = assemble_context(
+                [(f"{chunk.filename} › {chunk.section}", chunk.text) for chunk in chunks],
+                'chat',
+                reserved_text=instructions + prompt + "".join(message["content"] for message in history),
+                header="Excerpts from the uploaded files:\n\n",
+                template="[{number}] {name}\n{text}"
+            )
+            
             try:
-                response = client.chat.completions.create(
+                # Clicking stop reruns the script, which interrupts the wait or the loop below
+                stop_area.button("⏹️ Stop", key="stop_chat_response", help="Stop generating this response")
+                
+                stream = ChatStream(
+                    client,
+                    call_site='chat',
+                    session=st.session_state.session_id,
+                    on_wait=lambda position, paused_seconds: response_area.caption(queue_message(position, paused_seconds)),
+                    # Reading the session state is where Streamlit stops a script whose Stop was clicked
+                    check=lambda: st.session_state.session_id,
                     model=deployment_name,
                     messages=[
-                        {"role": "system", "content": f"You are a helpful assistant. Use the following context from uploaded files to answer questions. Format your responses using markdown for better readability (use headers, bullet points, code blocks, etc. when appropriate):\n\n{context}"},
-                        {"role": "user", "content": prompt}
+                        {"role": "system", "content": instructions},
+                        *history,
+                        {"role": "user", "content": f"{context.text}\n\nQuestion: {prompt}" if context.text else prompt}
                     ],
                     temperature=0.7,
-                    max_tokens=1000
+                    max_tokens=CALL_SITES['chat']['max_tokens'],
+                    **stream_options(st.session_state.get('azure_api_version', '2024-02-01'))
                 )
+                response_area.empty()
+                
+                for _ in stream:
+                    response_area.markdown(stream.text + "▌", unsafe_allow_html=False)
                 
-                assistant_response = response.choices[0].message.content
                 # Render markdown with better formatting
-                st.markdown(assistant_response, unsafe_allow_html=False)
-                st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+                response_area.markdown(stream.text, unsafe_allow_html=False)
                 
             except Exception as e:
                 st.error(f"Error calling Azure OpenAI: {str(e)}")
+            
+            finally:
+                # Also runs when a stop click interrupts the script, keeping the partial answer
+                stop_area.empty()
+                if stream is not None:
+                    stream.close()
+                    if stream.text:
+                        st.session_state.messages.append({"role": "assistant", "content": stream.text})
+                        st.session_state.chat_timings.append({
+                            "time_to_first_token": stream.time_to_first_token,
+                            "total_latency": stream.total_latency,
+                            "stopped": not stream.finished
+                        })
+                        # Summarizing older turns runs in the background, off this turn's critical path
+                        async_client = get_azure_client(asynchronous=True)
+                        if async_client:
+                            st.session_state.chat_history.maybe_compact(
+                                st.session_state.messages,
+                                async_client,
+                                deployment_name,
+                                CALL_SITES['chat_summary']['max_tokens'],
+                                session=st.session_state.session_id
+                            )
+            
+            if stream is not None and stream.finished:
+                sources = ", ".join(f"[{number}] {name}" for number, (name, _, kept) in enumerate(context.items, start=1) if kept)
+                st.caption(f"📎 Sources: {sources}")
+                if context.summary():
+                    st.caption(f"✂️ {context.summary()}")
+                st.caption(f"⏱️ First token {stream.time_to_first_token or 0:.1f}s · Total {stream.total_latency:.1f}s")
+
+GENERATION_ARTIFACTS = {
+    'business_plan': {
+        'button': "🚀 Generate Business Plan",
+        'prompt_builder': get_business_canvas_prompt,
+        'title': "📊 Your Generated Business Plan",
+        'download_label': "💾 Download Business Plan HTML",
+        'file_name': "business_plan.html",
+        'error': "Error generating business plan",
+    },
+    'value_proposition': {
+        'button': "💎 Generate Value Proposition",
+        'prompt_builder': get_value_proposition_prompt,
+        'title': "💎 Your Generated Value Proposition Canvas",
+        'download_label': "💾 Download Value Proposition Canvas HTML",
+        'file_name': "value_proposition_canvas.html",
+        'error': "Error generating value proposition canvas",
+    },
+}
+
+def request_regeneration(site):
+    st.session_state.regenerate_artifact = site
+
+def render_artifact(area, site):
+    artifact = GENERATION_ARTIFACTS[site]
+    result = st.session_state.generated_artifacts.get(site)
+    if not result:
+        return
+    
+    with area.container():
+        st.subheader(artifact['title'])
+        if result['from_cache']:
+            st.caption("⚡ Served from the response cache")
+        if result.get('stopped'):
+            st.caption("⏹️ Stopped early: this is the part generated so far")
+        
+        # Display the HTML
+        st.components.v1.html(result['html'], height=800, scrolling=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            # Also provide download option
+            st.download_button(
+                label=artifact['download_label'],
+                data=result['html'],
+                file_name=artifact['file_name'],
+                mime="text/html",
+                key=f"download_{site}"
+            )
+        with col2:
+            st.button(
+                "🔄 Regenerate",
+                key=f"regenerate_{site}",
+                help="Ask the model again instead of using the cached result",
+                on_click=request_regeneration,
+                args=(site,)
+            )
+
+def build_generation_context(call_site, prompt_builder):
+    context = st.session_state.document_context.assemble(
+        call_site,
+        reserved_text=prompt_builder(""),
+        header="\n\nCONTEXT FROM UPLOADED FILES:\n"
+    )
+    if context.summary():
+        st.warning(f"✂️ {context.summary()}")
+    return context
 
 def ai_generation_page():
     st.title("🎯 AI Business Canvas Generator")
@@ -305,98 +624,110 @@ def ai_generation_page():
                     
                 col1, col2 = st.columns([5, 1])
                 with col1:
-                    st.write(f"📄 {filename}")
+                    aliases = st.session_state.document_names.aliases(filename)
+                    st.write(f"📄 {filename}" + (f" (also uploaded as {', '.join(aliases)})" if aliases else ""))
                 with col2:
                     if st.button("🗑️", key=f"delete_gen_{filename}", help=f"Remove {filename}"):
-                        st.session_state.deleted_files.add(filename)
-                        del st.session_state.uploaded_files_content[filename]
+                        delete_file(filename)
                         st.rerun()
     
-    col1, col2 = st.columns(2)
+    requested = []
+    cols = st.columns(len(GENERATION_ARTIFACTS))
+    for col, (site, artifact) in zip(cols, GENERATION_ARTIFACTS.items()):
+        with col:
+            if st.button(artifact['button'], type="primary", use_container_width=True):
+                requested.append(site)
     
-    with col1:
-        generate_business_plan = st.button("🚀 Generate Business Plan", type="primary", use_container_width=True)
+    if st.button("✨ Generate All", use_container_width=True, help="Generate every canvas at the same time"):
+        requested = list(GENERATION_ARTIFACTS)
     
-    with col2:
-        generate_value_prop = st.button("💎 Generate Value Proposition", type="primary", use_container_width=True)
+    regenerate = st.session_state.pop('regenerate_artifact', None)
+    if regenerate and regenerate not in requested:
+        requested.append(regenerate)
     
-    if generate_business_plan:
-        with st.spinner("Generating your stunning business plan... DO NOT GO AWAY!"):
-            try:
-                # Build context from uploaded files
-                context = ""
-                if st.session_state.uploaded_files_content:
-                    context = "\n\nCONTEXT FROM UPLOADED FILES:\n" + "\n\n".join([f"File: {filename}\n{content}" for filename, content in st.session_state.uploaded_files_content.items()])
-                
-                canvas_prompt = get_business_canvas_prompt(context)
-                
-                response = client.chat.completions.create(
-                    model=deployment_name,
-                    messages=[{"role": "user", "content": canvas_prompt}],
-                    temperature=0.8,
-                    max_tokens=6000
-                )
-                
-                html_content = response.choices[0].message.content
-                
-                # Clean up any markdown formatting
-                if html_content.startswith('```html'):
-                    html_content = html_content.replace('```html', '').replace('```', '')
-                
-                st.subheader("📊 Your Generated Business Plan")
-                
-                # Display the HTML
-                st.components.v1.html(html_content, height=800, scrolling=True)
-                
-                # Also provide download option
-                st.download_button(
-                    label="💾 Download Business Plan HTML",
-                    data=html_content,
-                    file_name="business_plan.html",
-                    mime="text/html"
-                )
-                
-            except Exception as e:
-                st.error(f"Error generating business plan: {str(e)}")
+    # One slot per artifact so each result appears in place as soon as it is ready
+    areas = {site: st.empty() for site in GENERATION_ARTIFACTS}
     
-    if generate_value_prop:
-        with st.spinner("Generating your value proposition canvas..."):
-            try:
-                # Build context from uploaded files  
-                context = ""
-                if st.session_state.uploaded_files_content:
-                    context = "\n\nCONTEXT FROM UPLOADED FILES:\n" + "\n\n".join([f"File: {filename}\n{content}" for filename, content in st.session_state.uploaded_files_content.items()])
-                
-                vpc_prompt = get_value_proposition_prompt(context)
-                
-                response = client.chat.completions.create(
-                    model=deployment_name,
-                    messages=[{"role": "user", "content": vpc_prompt}],
-                    temperature=0.8,
-                    max_tokens=3000
-                )
-                
-                html_content = response.choices[0].message.content
-                
-                # Clean up any markdown formatting
-                if html_content.startswith('```html'):
-                    html_content = html_content.replace('```html', '').replace('```', '')
-                
-                st.subheader("💎 Your Generated Value Proposition Canvas")
-                
-                # Display the HTML
-                st.components.v1.html(html_content, height=800, scrolling=True)
-                
-                # Also provide download option
-                st.download_button(
-                    label="💾 Download Value Proposition Canvas HTML",
-                    data=html_content,
-                    file_name="value_proposition_canvas.html",
-                    mime="text/html"
-                )
+    if requested:
+        async_client = get_azure_client(asynchronous=True)
+        api_version = st.session_state.get('azure_api_version', '2024-02-01')
+        streams = {}
+        futures = {}
+        # The canvases draw on whole documents, so every page has to be converted first
+        for filename in list(st.session_state.lazy_documents):
+            materialize_pages(filename)
+        for site in requested:
+            artifact = GENERATION_ARTIFACTS[site]
+            context = build_generation_context(site, artifact['prompt_builder'])
+            streams[site] = HtmlStream()
+            futures[site] = run_async(cached_completion(
+                async_client,
+                regenerate=(site == regenerate),
+                call_site=site,
+                on_delta=streams[site].feed,
+                session=st.session_state.session_id,
+                on_wait=streams[site].wait,
+                model=deployment_name,
+                messages=[{"role": "user", "content": artifact['prompt_builder'](context.text)}],
+                temperature=0.8,
+                max_tokens=CALL_SITES[site]['max_tokens'],
+                **stream_options(api_version)
+            ))
+        
+        # Clicking stop reruns the script, which interrupts the loop below
+        stop_area = st.empty()
+        stop_area.button("⏹️ Stop", key="stop_generation", help="Stop generating and keep what has been written so far")
+        
+        progress_areas = {}
+        for site in requested:
+            with areas[site].container():
+                st.subheader(GENERATION_ARTIFACTS[site]['title'])
+                progress_areas[site] = (st.empty(), st.empty())
+        
+        pending = dict(futures)
+        try:
+            while pending:
+                for site, future in list(pending.items()):
+                    artifact = GENERATION_ARTIFACTS[site]
+                    if not future.done():
+                        # Show the canvas as its sections close
+                        caption_area, canvas_area = progress_areas[site]
+                        written = len(streams[site].text)
+                        if not written and streams[site].waiting is not None:
+                            caption_area.caption(queue_message(*streams[site].waiting))
+                        else:
+                            caption_area.caption(f"✍️ Generating... {written:,} characters so far")
+                        snapshot = streams[site].snapshot()
+                        if snapshot is not None:
+                            with canvas_area:
+                                st.components.v1.html(snapshot, height=800, scrolling=True)
+                        continue
+                    
+                    del pending[site]
+                    try:
+                        html_content, from_cache = future.result()
+                        
+                        # Keep the result so it survives reruns
+                        st.session_state.generated_artifacts[site] = {'html': strip_code_fences(html_content), 'from_cache': from_cache}
+                        render_artifact(areas[site], site)
+                        
+                    except Exception as e:
+                        areas[site].error(f"{artifact['error']}: {str(e)}")
                 
-            except Exception as e:
-                st.error(f"Error generating value proposition canvas: {str(e)}")
+                if pending:
+                    time.sleep(0.25)
+        finally:
+            # Also runs when a stop click interrupts the script
+            stop_area.empty()
+            for site, future in pending.items():
+                future.cancel()
+                partial = streams[site].html
+                if partial.strip():
+                    st.session_state.generated_artifacts[site] = {'html': partial, 'from_cache': False, 'stopped': True}
+    
+    for site in GENERATION_ARTIFACTS:
+        if site not in requested:
+            render_artifact(areas[site], site)
 
 def settings_page():
     st.title("⚙️ Settings")
@@ -438,7 +769,8 @@ def settings_page():
             st.session_state.azure_api_key = azure_api_key
             st.session_state.deployment_name = deployment_name
             st.session_state.azure_api_version = azure_api_version
-            st.session_state.azure_client = None  # Reset client to use new settings
+            # Open the connection now so the first request does not pay for the TLS handshake
+            warm_up(azure_endpoint, azure_api_key, azure_api_version)
             st.success("Settings saved successfully!")
     
     with col2:
@@ -448,14 +780,13 @@ def settings_page():
             else:
                 with st.spinner("Testing connection..."):
                     try:
-                        test_client = AzureOpenAI(
-                            azure_endpoint=azure_endpoint,
-                            api_key=azure_api_key,
-                            api_version=azure_api_version
-                        )
+                        test_client = get_client(azure_endpoint, azure_api_key, azure_api_version)
                         
                         # Test with a simple completion
-                        response = test_client.chat.completions.create(
+                        response = completion(
+                            test_client,
+                            'connection_test',
+                            session=st.session_state.session_id,
                             model=deployment_name,
                             messages=[{"role": "user", "content": "Hello, this is a connection test."}],
                             max_tokens=10,
@@ -475,9 +806,123 @@ def settings_page():
         st.success("✅ Azure OpenAI configured")
     else:
         st.warning("⚠️ Please configure all Azure OpenAI settings")
+    
+    st.subheader("Document Storage")
+    storage = process_usage()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Documents", f"{storage['documents']:,}", help=f"Across {storage['sessions']} sessions in this server process")
+    col2.metric("In Memory", f"{storage['memory_bytes'] / 1024 / 1024:.1f} / {storage['budget_bytes'] / 1024 / 1024:.0f} MB")
+    col3.metric("Spilled to Disk", f"{storage['disk_bytes'] / 1024 / 1024:.1f} MB")
+    
+    for title, label, cache in [
+        ("Conversion Cache", "Cached Files", get_conversion_cache()),
+        ("Response Cache", "Cached Responses", get_response_cache()),
+    ]:
+        st.subheader(title)
+        cache_stats = cache.stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric(label, f"{cache_stats['entries']:,}")
+        col2.metric("Size", f"{cache_stats['bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB")
+        col3.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}", help=f"{cache_stats['hits']:,} hits, {cache_stats['misses']:,} misses")
+    
+    st.subheader("Model Request Queue")
+    queue = get_scheduler().status()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Queued Requests", f"{queue['queued']:,}", help=", ".join(f"{site}: {count}" for site, count in queue['queued_by_call_site'].items()) or None)
+    col2.metric("Oldest Wait", f"{queue['oldest_wait']:.1f}s")
+    col3.metric("Backing Off", f"{queue['paused_for']:.0f}s", help="Requests are held back after Azure OpenAI answers 429 Too Many Requests")
+    limits = " · ".join(
+        f"{value:,.0f} {unit} per minute" for value, unit in [(queue['requests_per_minute'], "requests"), (queue['tokens_per_minute'], "tokens")] if value
+    )
+    st.caption(f"Rate limit: {limits}" if limits else "No rate limit set; requests only wait while Azure OpenAI asks to back off. Set INDIEAPP_RATE_LIMIT_RPM and INDIEAPP_RATE_LIMIT_TPM to the deployment's quota.")
+    
+    st.subheader("Prompt Cache")
+    prompt_usage = usage_stats()
+    if not prompt_usage:
+        st.caption("No model calls have reported token usage yet.")
+    for call_site, stats in prompt_usage.items():
+        latencies = " · ".join(
+            f"{label} {stats[key]:.1f}s" for label, key in [("cached", 'cached_latency'), ("uncached", 'uncached_latency')] if stats[key] is not None
+        )
+        st.caption(
+            f"**{call_site}** — {stats['calls']:,} calls, {stats['cached_tokens']:,} of {stats['prompt_tokens']:,} prompt tokens cached "
+            f"({stats['cached_share']:.0%}) · mean latency {latencies}"
+        )
+
+METRIC_SECTIONS = [
+    ("llm", "🤖 Model Calls", ['input_tokens', 'output_tokens', 'cached_tokens']),
+    ("queue", "⏳ Model Request Queue", ['retries']),
+    ("context", "🧩 Context Builds", ['input_tokens', 'output_tokens']),
+    ("conversion", "📄 Conversions", ['input_bytes', 'output_bytes']),
+    ("startup", "🚀 Startup", []),
+]
+
+def metrics_page():
+    st.title("📈 Metrics")
+    st.caption(
+        f"Everything recorded by this server process since it started, across all sessions. "
+        f"Percentiles cover the last {metrics.WINDOW_EVENTS:,} operations of each kind; throughput the last {metrics.THROUGHPUT_WINDOW // 60} minutes."
+    )
+    if st.button("🔄 Refresh"):
+        st.rerun()
+    
+    rows = metrics.summary()
+    for kind, title, fields in METRIC_SECTIONS:
+        st.subheader(title)
+        kind_rows = [row for row in rows if row['kind'] == kind]
+        if not kind_rows:
+            st.caption("Nothing recorded yet.")
+            continue
+        
+        table = []
+        for row in kind_rows:
+            entry = {
+                "Name": row['name'],
+                "Count": row['count'],
+                "Errors": row['errors'],
+                "p50 (s)": round(row['p50'], 3),
+                "p95 (s)": round(row['p95'], 3),
+                "Per minute": round(row['per_minute'], 1),
+            }
+            for field in fields:
+                label = field.replace('_', ' ').capitalize()
+                if field.endswith('_bytes'):
+                    entry[f"Avg {label[:-6]} KB"] = round(row[f"avg_{field}"] / 1024, 1)
+                elif field == 'retries':
+                    entry[f"Avg {label}"] = round(row[f"avg_{field}"], 2)
+                else:
+                    entry[f"Avg {label}"] = round(row[f"avg_{field}"])
+            table.append(entry)
+        st.dataframe(table, use_container_width=True, hide_index=True)
+    
+    errors = metrics.recent_errors()
+    if errors:
+        st.subheader("⚠️ Recent Errors")
+        st.dataframe([
+            {
+                "Time": time.strftime("%H:%M:%S", time.localtime(event['time'])),
+                "Kind": event['kind'],
+                "Name": event['name'],
+                "Error": event['error'],
+                "Duration (s)": round(event['duration'], 3),
+            }
+            for event in errors
+        ], use_container_width=True, hide_index=True)
+    
+    st.subheader("Export")
+    st.download_button(
+        label="💾 Download Prometheus Metrics",
+        data=metrics.prometheus_text(),
+        file_name="indieapp_metrics.prom",
+        mime="text/plain"
+    )
+    st.caption("Set INDIEAPP_METRICS_FILE to append every operation to a JSON-lines file, or INDIEAPP_METRICS_PROMETHEUS_FILE to keep a Prometheus text file up to date for scraping.")
 
 def main():
+    # The first session starts loading the rest in the background
+    prewarm()
     init_session_state()
+    collect_conversions()
     
     st.sidebar.title("🚀 IndieApp Demo")
     
@@ -490,6 +935,8 @@ def main():
         st.session_state.current_page = "ai_generation"
     if st.sidebar.button("⚙️ Settings", use_container_width=True):
         st.session_state.current_page = "settings"
+    if st.sidebar.button("📈 Metrics", use_container_width=True):
+        st.session_state.current_page = "metrics"
     
     # Initialize current page if not set
     if 'current_page' not in st.session_state:
@@ -504,6 +951,8 @@ def main():
         ai_generation_page()
     elif st.session_state.current_page == "settings":
         settings_page()
+    elif st.session_state.current_page == "metrics":
+        metrics_page()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
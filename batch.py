@@ -0,0 +1,278 @@
+"""
+Headless batch generation of canvases for a tree of client folders
+
+    python batch.py clients/ --output canvases/ --concurrency 8
+
+Every subdirectory of the input directory is one client. Its documents,
+found recursively, are converted, and each canvas is generated from them
+and written to <output>/<client>/<canvas>.html. Canvases that already
+exist are skipped, so an interrupted run picks up where it stopped.
+Azure OpenAI settings come from the AZURE_OPENAI_* environment variables
+or the matching options.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from conversion import SUPPORTED_TYPES, convert_files, convert_to_file
+from context import CALL_SITES, DocumentContext
+from document_names import content_digest, file_digest
+from doc_store import DocumentStore
+from html_stream import strip_code_fences
+from ingest import read_blocks, use_streaming
+from prompts import get_business_canvas_prompt, get_value_proposition_prompt
+from rate_limit import get_scheduler
+import metrics
+
+# Call site: (prompt builder, output file name), as on the AI Generation page
+CANVASES = {
+    'business_plan': (get_business_canvas_prompt, "business_plan.html"),
+    'value_proposition': (get_value_proposition_prompt, "value_proposition_canvas.html"),
+}
+CONTEXT_HEADER = "\n\nCONTEXT FROM UPLOADED FILES:\n"
+
+
+def find_clients(root):
+    """(name, directory) of every client folder: the subdirectories of root, or root itself if it has none."""
+    folders = sorted(entry.name for entry in os.scandir(root) if entry.is_dir() and not entry.name.startswith("."))
+    if not folders:
+        return [(os.path.basename(os.path.abspath(root)), root)]
+    return [(folder, os.path.join(root, folder)) for folder in folders]
+
+
+def find_documents(directory):
+    """Paths of the supported files under directory, relative to it, in a stable order."""
+    documents = []
+    for current, folders, files in os.walk(directory):
+        folders[:] = sorted(folder for folder in folders if not folder.startswith("."))
+        for filename in sorted(files):
+            if filename.split('.')[-1].lower() in SUPPORTED_TYPES and not filename.startswith("."):
+                documents.append(os.path.relpath(os.path.join(current, filename), directory))
+    return documents
+
+
+def convert_client(directory):
+    """Convert a client's documents. Returns (DocumentStore of relative path: markdown, {relative path: error})."""
+    files = []
+    large = []
+    digests = set()
+    paths = find_documents(directory)
+    for path in paths:
+        full_path = os.path.join(directory, path)
+        # Large files are hashed and converted from disk, never read whole
+        streamed = use_streaming(path, os.path.getsize(full_path))
+        if streamed:
+            data = None
+            digest = file_digest(full_path)
+        else:
+            with open(full_path, "rb") as f:
+                data = f.read()
+            digest = content_digest(data)
+        # The same file saved twice in a folder is only used once
+        if digest in digests:
+            continue
+        digests.add(digest)
+        if streamed:
+            large.append((path, full_path))
+        else:
+            files.append((path, data))
+
+    converted, errors = convert_files(files) if files else ({}, {})
+    outputs = {}
+    try:
+        for path, full_path in large:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".md") as tmp_file:
+                outputs[path] = tmp_file.name
+            try:
+                convert_to_file(path, full_path, outputs[path])
+            except Exception as e:
+                errors[path] = str(e) or e.__class__.__name__
+                os.unlink(outputs.pop(path))
+
+        # Keep the documents in folder order, whatever order they finished in.
+        # Streamed output is loaded a block at a time and stays on disk in the store
+        documents = DocumentStore()
+        for path in paths:
+            if path in converted:
+                documents[path] = converted[path]
+            elif path in outputs:
+                for block in read_blocks(outputs[path]):
+                    documents.append(path, block)
+                if path not in documents:
+                    documents[path] = ""
+    finally:
+        for output_path in outputs.values():
+            os.unlink(output_path)
+    return documents, errors
+
+
+def write_atomically(path, text):
+    # An interrupted run never leaves a half-written canvas that would be skipped next time
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+async def _make_semaphore(concurrency):
+    # Created on the event loop that uses it
+    return asyncio.Semaphore(concurrency)
+
+
+async def generate(client, semaphore, call_site, deployment_name, prompt, regenerate):
+    from llm import cached_completion
+
+    async with semaphore:
+        started = time.perf_counter()
+        text, from_cache = await cached_completion(
+            client,
+            regenerate=regenerate,
+            call_site=call_site,
+            session="batch",
+            model=deployment_name,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.8,
+            max_tokens=CALL_SITES[call_site]['max_tokens']
+        )
+        return strip_code_fences(text), from_cache, time.perf_counter() - started
+
+
+def summarize(results, started, totals):
+    wall = time.perf_counter() - started
+    generated = [result for result in results if result['status'] == 'generated']
+    latencies = sorted(result['seconds'] for result in generated if not result['from_cache'])
+    llm_rows = [row for row in metrics.summary() if row['kind'] == 'llm' and row['name'] in CANVASES]
+    summary = dict(totals)
+    summary.update({
+        'wall_seconds': wall,
+        'generated': len(generated),
+        'from_cache': sum(1 for result in generated if result['from_cache']),
+        'failed': sum(1 for result in results if result['status'] == 'failed'),
+        'canvases_per_minute': len(generated) * 60 / wall if wall else 0.0,
+        'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+        'latency_p95': latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))] if latencies else None,
+        'input_tokens': sum(round(row['avg_input_tokens'] * row['count']) for row in llm_rows),
+        'output_tokens': sum(round(row['avg_output_tokens'] * row['count']) for row in llm_rows),
+        'cached_tokens': sum(round(row['avg_cached_tokens'] * row['count']) for row in llm_rows),
+    })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate canvases for every client folder under a directory")
+    parser.add_argument("input", help="Directory with one subdirectory of documents per client")
+    parser.add_argument("--output", "-o", default="canvases", help="Directory for the generated HTML (default: canvases)")
+    parser.add_argument("--canvases", nargs="+", choices=list(CANVASES), default=list(CANVASES))
+    parser.add_argument("--concurrency", type=int, default=4, help="Model requests in flight at once (default: 4)")
+    parser.add_argument("--requests-per-minute", type=float, help="Deployment quota in requests per minute (default: INDIEAPP_RATE_LIMIT_RPM)")
+    parser.add_argument("--tokens-per-minute", type=float, help="Deployment quota in tokens per minute (default: INDIEAPP_RATE_LIMIT_TPM)")
+    parser.add_argument("--force", action="store_true", help="Generate canvases again even if their file exists")
+    parser.add_argument("--regenerate", action="store_true", help="Bypass the response cache as well")
+    parser.add_argument("--report", help="Also write the summary as JSON to this file")
+    parser.add_argument("--endpoint", default=os.environ.get("AZURE_OPENAI_ENDPOINT"))
+    parser.add_argument("--api-key", default=os.environ.get("AZURE_OPENAI_API_KEY"))
+    parser.add_argument("--api-version", default=os.environ.get("AZURE_OPENAI_API_VERSION", "2024-02-01"))
+    parser.add_argument("--deployment", default=os.environ.get("AZURE_OPENAI_DEPLOYMENT"))
+    args = parser.parse_args()
+
+    if not (args.endpoint and args.api_key and args.deployment):
+        parser.error("set the endpoint, API key and deployment with the options or AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY and AZURE_OPENAI_DEPLOYMENT")
+    if not os.path.isdir(args.input):
+        parser.error(f"{args.input} is not a directory")
+
+    from clients import get_client
+    from llm import run_async
+
+    client = get_client(args.endpoint, args.api_key, args.api_version, asynchronous=True)
+    semaphore = run_async(_make_semaphore(max(1, args.concurrency))).result()
+    get_scheduler().configure(args.requests_per_minute, args.tokens_per_minute)
+
+    clients = find_clients(args.input)
+    totals = {'clients': len(clients), 'skipped': 0, 'empty_clients': 0, 'conversion_errors': 0, 'documents': 0}
+    results = []
+    pending = {}
+    started = time.perf_counter()
+    interrupted = False
+
+    def collect(futures):
+        for future in futures:
+            item = pending.pop(future)
+            try:
+                html, from_cache, seconds = future.result()
+                write_atomically(item['path'], html)
+                item.update(status='generated', from_cache=from_cache, seconds=seconds)
+                note = " (cached)" if from_cache else ""
+                print(f"[{len(results) + 1}] {item['client']}/{os.path.basename(item['path'])} in {seconds:.1f}s{note}", flush=True)
+            except Exception as e:
+                item.update(status='failed', error=str(e) or e.__class__.__name__)
+                print(f"[{len(results) + 1}] {item['client']}/{os.path.basename(item['path'])} failed: {item['error']}", flush=True)
+            results.append(item)
+
+    try:
+        for number, (name, directory) in enumerate(clients, start=1):
+            outputs = {site: os.path.join(args.output, name, CANVASES[site][1]) for site in args.canvases}
+            todo = [site for site in args.canvases if args.force or not os.path.exists(outputs[site])]
+            totals['skipped'] += len(args.canvases) - len(todo)
+            if not todo:
+                continue
+
+            documents, errors = convert_client(directory)
+            totals['documents'] += len(documents)
+            totals['conversion_errors'] += len(errors)
+            for path, error in errors.items():
+                print(f"  ! {name}/{path}: {error}", flush=True)
+            if not documents:
+                totals['empty_clients'] += 1
+                print(f"Client {number}/{len(clients)} {name}: no documents converted, skipped", flush=True)
+                continue
+            print(f"Client {number}/{len(clients)} {name}: {len(documents)} documents, generating {', '.join(todo)}", flush=True)
+
+            document_context = DocumentContext(documents)
+            for site in todo:
+                builder = CANVASES[site][0]
+                context = document_context.assemble(site, reserved_text=builder(""), header=CONTEXT_HEADER)
+                future = run_async(generate(client, semaphore, site, args.deployment, builder(context.text), args.regenerate))
+                pending[future] = {'client': name, 'call_site': site, 'path': outputs[site]}
+
+            # Convert ahead only while the model has work queued, so memory stays bounded
+            while len(pending) >= 2 * args.concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    except KeyboardInterrupt:
+        for future in pending:
+            future.cancel()
+        print("Interrupted; finished canvases are kept and the next run continues from there", flush=True)
+        interrupted = True
+
+    summary = summarize(results, started, totals)
+    print(
+        f"\n{summary['generated']} canvases generated ({summary['from_cache']} from cache), {summary['skipped']} already done, "
+        f"{summary['failed']} failed, for {summary['clients']} clients in {summary['wall_seconds']:.0f}s "
+        f"({summary['canvases_per_minute']:.1f} per minute)"
+    )
+    if summary['latency_p50'] is not None:
+        print(f"Time per canvas, queueing included, p50 {summary['latency_p50']:.1f}s, p95 {summary['latency_p95']:.1f}s; "
+              f"{summary['input_tokens']:,} input tokens ({summary['cached_tokens']:,} cached), {summary['output_tokens']:,} output tokens")
+    if summary['empty_clients'] or summary['conversion_errors']:
+        print(f"{summary['empty_clients']} clients without documents, {summary['conversion_errors']} documents failed to convert")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({'summary': summary, 'items': results}, f, indent=2)
+    # 130 is the shell's status for a run stopped with Ctrl+C
+    sys.exit(130 if interrupted else 1 if summary['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Benchmarks and load tests, run from the repository root with python -m benchmarks.<name>
+"""
@@ -0,0 +1,175 @@
+"""
+Generated input files for the conversion benchmarks
+
+Every supported type is generated at each size from the same deterministic
+text, so results are comparable between runs and machines. PDFs are written
+by hand; DOCX, XLSX and PPTX need python-docx, openpyxl and python-pptx,
+which MarkItDown itself needs to read them.
+"""
+
+import io
+import csv
+import random
+
+FIXTURE_TYPES = ['pdf', 'docx', 'xlsx', 'pptx', 'csv', 'html', 'md', 'txt']
+
+# Scale factor per size: pages, slides, sections or hundreds of rows
+SIZES = {'small': 1, 'medium': 10, 'large': 50}
+
+ROWS_PER_UNIT = 100
+LINES_PER_PAGE = 45
+
+WORDS = (
+    "market customer revenue channel partner segment pricing growth product value cost "
+    "subscription retention acquisition churn margin forecast launch pilot feedback roadmap "
+    "supplier logistics platform analytics automation onboarding support license contract"
+).split()
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(rng, sentences=5):
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def _rows(rng, count):
+    header = ["Region", "Product", "Quarter", "Units", "Revenue", "Notes"]
+    rows = [header]
+    for index in range(count):
+        units = rng.randint(10, 5000)
+        rows.append([
+            rng.choice(["North", "South", "East", "West"]),
+            rng.choice(WORDS).title(),
+            f"Q{index % 4 + 1}",
+            units,
+            round(units * rng.uniform(5, 80), 2),
+            _sentence(rng, 6),
+        ])
+    return rows
+
+
+def _txt(rng, scale):
+    return "\n\n".join(_paragraph(rng) for _ in range(scale * 12)).encode("utf-8")
+
+
+def _md(rng, scale):
+    parts = []
+    for section in range(scale * 4):
+        parts.append(f"## Section {section + 1}\n\n" + "\n\n".join(_paragraph(rng) for _ in range(3)))
+        parts.append("- " + "\n- ".join(_sentence(rng, 8) for _ in range(4)))
+    return "\n\n".join(parts).encode("utf-8")
+
+
+def _csv(rng, scale):
+    output = io.StringIO()
+    csv.writer(output).writerows(_rows(rng, scale * ROWS_PER_UNIT))
+    return output.getvalue().encode("utf-8")
+
+
+def _html(rng, scale):
+    rows = _rows(rng, scale * ROWS_PER_UNIT // 2)
+    table = "".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in rows)
+    paragraphs = "".join(f"<h2>Section {index + 1}</h2><p>{_paragraph(rng)}</p>" for index in range(scale * 4))
+    return f"<html><head><title>Report</title></head><body>{paragraphs}<table>{table}</table></body></html>".encode("utf-8")
+
+
+def _pdf(rng, scale):
+    # A minimal PDF: one Helvetica content stream per page
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(scale * 2):
+        lines = [f"Page {page + 1}"] + [_sentence(rng, 10) for _ in range(LINES_PER_PAGE)]
+        text = " T* ".join(f"({line})Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return output.getvalue()
+
+
+def _docx(rng, scale):
+    from docx import Document
+
+    document = Document()
+    for section in range(scale * 4):
+        document.add_heading(f"Section {section + 1}", level=2)
+        for _ in range(3):
+            document.add_paragraph(_paragraph(rng))
+    rows = _rows(rng, scale * 10)
+    table = document.add_table(rows=len(rows), cols=len(rows[0]))
+    for row, values in zip(table.rows, rows):
+        for cell, value in zip(row.cells, values):
+            cell.text = str(value)
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+def _xlsx(rng, scale):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for sheet in range(max(1, scale // 10) + 1):
+        worksheet = workbook.create_sheet(f"Sheet{sheet + 1}")
+        for row in _rows(rng, scale * ROWS_PER_UNIT):
+            worksheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def _pptx(rng, scale):
+    from pptx import Presentation
+
+    presentation = Presentation()
+    layout = presentation.slide_layouts[1]
+    for number in range(scale * 5):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = f"Slide {number + 1}: {rng.choice(WORDS).title()}"
+        body = slide.placeholders[1].text_frame
+        body.text = _sentence(rng, 8)
+        for _ in range(4):
+            body.add_paragraph().text = _sentence(rng, 8)
+    output = io.BytesIO()
+    presentation.save(output)
+    return output.getvalue()
+
+
+GENERATORS = {
+    'pdf': _pdf,
+    'docx': _docx,
+    'xlsx': _xlsx,
+    'pptx': _pptx,
+    'csv': _csv,
+    'html': _html,
+    'md': _md,
+    'txt': _txt,
+}
+
+
+def generate_fixture(file_type, size):
+    """Return (filename, data) for one generated file. Raises ImportError if the type's writer is not installed."""
+    rng = random.Random(f"{file_type}-{size}")
+    data = GENERATORS[file_type](rng, SIZES[size])
+    return f"fixture-{size}.{file_type}", data
+
+
+def generate_markdown(size):
+    """Markdown of roughly the size a converted document of that size would have."""
+    rng = random.Random(f"markdown-{size}")
+    return _md(rng, SIZES[size] * 4).decode("utf-8")
@@ -0,0 +1,141 @@
+"""
+Import-time profile of the app's entry point
+
+Imports what app.py imports at the top, in a fresh interpreter with
+`python -X importtime`, and reports where the time went:
+
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --budget-ms 2500 --top 30
+
+The report lists the slowest modules and the total per top-level package.
+With --budget-ms the exit status is 1 when the app's own imports (those
+beyond Streamlit) take longer, so CI can catch startup regressions.
+"""
+
+import os
+import ast
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+# Imported first, and reported apart from the app's own import cost
+BASELINE = "streamlit"
+
+
+def entry_point_imports(path=APP_PATH):
+    """The modules app.py imports at module level, in order."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def parse_importtime(output):
+    """
+    (module, self_us, cumulative_us, depth) for every line of -X importtime output.
+
+    Depth 0 are modules imported directly by the profiled statement.
+    """
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        records.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return records
+
+
+def profile_once(modules):
+    """Import modules in a new interpreter; returns (importtime records, wall seconds)."""
+    statement = "; ".join(f"import {module}" for module in modules)
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "import failed")
+    return parse_importtime(completed.stderr), wall
+
+
+def summarize(records):
+    top_level = [record for record in records if record[3] == 0]
+    packages = {}
+    for name, self_us, _, _ in records:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    baseline_us = sum(cumulative for name, _, cumulative, _ in top_level if name.split(".")[0] == BASELINE)
+    total_us = sum(cumulative for _, _, cumulative, _ in top_level)
+    return {
+        'total_ms': total_us / 1000,
+        'baseline_ms': baseline_us / 1000,
+        'app_ms': (total_us - baseline_us) / 1000,
+        'packages_ms': {package: us / 1000 for package, us in sorted(packages.items(), key=lambda item: -item[1])},
+        'modules_ms': {name: cumulative / 1000 for name, _, cumulative, _ in sorted(records, key=lambda record: -record[2])},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the import time of the app's entry point")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters to run; the median run is reported")
+    parser.add_argument("--top", type=int, default=20, help="Slowest modules and packages to print")
+    parser.add_argument("--budget-ms", type=float, help="Fail when the app's imports beyond Streamlit take longer")
+    parser.add_argument("--modules", nargs="+", help="Modules to import instead of app.py's imports")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/imports-<timestamp>.json)")
+    args = parser.parse_args()
+
+    modules = args.modules or entry_point_imports()
+    if BASELINE in modules:
+        modules = [BASELINE] + [module for module in modules if module != BASELINE]
+
+    runs = []
+    for _ in range(args.repeat):
+        records, wall = profile_once(modules)
+        runs.append(dict(summarize(records), wall_seconds=wall))
+    # The first run also pays for compiling bytecode, so take the median
+    report = sorted(runs, key=lambda run: run['total_ms'])[len(runs) // 2]
+
+    print(f"Imports: {', '.join(modules)}")
+    print(f"Total {report['total_ms']:.0f} ms · {BASELINE} {report['baseline_ms']:.0f} ms · "
+          f"app {report['app_ms']:.0f} ms · interpreter wall {report['wall_seconds']:.2f}s "
+          f"(median of {len(runs)}, app range {min(run['app_ms'] for run in runs):.0f}-{max(run['app_ms'] for run in runs):.0f} ms)")
+    print("\nSlowest packages (self time):")
+    for package, ms in list(report['packages_ms'].items())[:args.top]:
+        print(f"  {ms:8.1f} ms  {package}")
+    print("\nSlowest modules (cumulative):")
+    for module, ms in list(report['modules_ms'].items())[:args.top]:
+        print(f"  {ms:8.1f} ms  {module}")
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("imports-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            'started_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'python': sys.version.split()[0],
+            'modules': modules,
+            'runs': [{key: run[key] for key in ('total_ms', 'baseline_ms', 'app_ms', 'wall_seconds')} for run in runs],
+            'median_app_ms': statistics.median(run['app_ms'] for run in runs),
+            'report': report,
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.budget_ms is not None and report['app_ms'] > args.budget_ms:
+        print(f"App imports took {report['app_ms']:.0f} ms, over the budget of {args.budget_ms:g} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Concurrent-session load test against the bundled mock endpoint
+
+Each simulated session drives the real pages through Streamlit's AppTest:
+it uploads files on the File Upload page and waits for their conversion,
+asks questions on the AI Chat page and runs "Generate All" on the AI
+Generation page. Levels of concurrent sessions are run one after another:
+
+    python -m benchmarks.load_test --sessions 1 2 4 8 16
+
+The report gives throughput, latency percentiles and memory per session for
+every level, and the level at which the process saturated: the first one
+whose throughput grew less than 10% over the level before, or where more
+than 5% of sessions failed.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import SIZES, FIXTURE_TYPES, generate_fixture
+from benchmarks.mock_server import MockSettings, start_server
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+API_VERSION = "2024-10-21"
+QUESTIONS = [
+    "What are the main revenue streams?",
+    "Which customer segments are mentioned?",
+    "Summarize the pricing and the key risks.",
+]
+POLL_INTERVAL = 0.2
+SATURATION_GAIN = 1.1
+MAX_ERROR_RATE = 0.05
+
+
+def memory_bytes():
+    """Python allocations when tracing, otherwise the resident memory of this process."""
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current usage, but the best available off Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def _new_session(endpoint, script_timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=script_timeout)
+    at.session_state.azure_endpoint = endpoint
+    at.session_state.azure_api_key = "load-test"
+    at.session_state.azure_api_version = API_VERSION
+    at.session_state.deployment_name = "load-test"
+    at.session_state.current_page = "file_upload"
+    return at
+
+
+def _problems(at):
+    return [str(element.value) for element in at.exception] + [str(element.value) for element in at.error]
+
+
+def run_session(number, endpoint, files, questions, script_timeout, upload_timeout):
+    """Drive one session through upload, chat and generation. Returns (result, AppTest)."""
+    from jobs import submit_conversion
+
+    result = {'session': number, 'latency': {}, 'chat': [], 'errors': []}
+    at = _new_session(endpoint, script_timeout)
+    session_started = time.perf_counter()
+    try:
+        at.run()
+
+        # Unless --with-caches is given, every session converts its own copy of the files
+        started = time.perf_counter()
+        session_files = [(f"s{number}-{filename}", data) for filename, data in files]
+        uploader = at.get("file_uploader")[0]
+        if hasattr(uploader, "upload"):
+            for filename, data in session_files:
+                uploader.upload(filename, data)
+            at.run()
+        else:
+            # Older Streamlit cannot upload in AppTest: queue the same jobs the page would
+            for filename, data in session_files:
+                at.session_state.conversion_jobs[filename] = submit_conversion(filename, data)
+        deadline = time.monotonic() + upload_timeout
+        while any(job.pending for job in at.session_state.conversion_jobs.values()):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Conversions did not finish within {upload_timeout:g}s")
+            time.sleep(POLL_INTERVAL)
+        at.run()
+        result['latency']['upload'] = time.perf_counter() - started
+        result['documents'] = len(at.session_state.uploaded_files_content)
+        result['errors'] += _problems(at)
+
+        at.session_state.current_page = "ai_chat"
+        at.run()
+        for question in questions:
+            started = time.perf_counter()
+            at.chat_input[0].set_value(question).run()
+            result['chat'].append(time.perf_counter() - started)
+            result['errors'] += _problems(at)
+
+        at.session_state.current_page = "ai_generation"
+        at.run()
+        started = time.perf_counter()
+        next(button for button in at.button if "Generate All" in button.label).click().run()
+        result['latency']['generate_all'] = time.perf_counter() - started
+        result['errors'] += _problems(at)
+    except Exception as e:
+        result['errors'].append(f"{e.__class__.__name__}: {e}")
+
+    result['latency']['session'] = time.perf_counter() - session_started
+    result['ok'] = not result['errors']
+    return result, at
+
+
+def run_level(level, endpoint, files, questions, args):
+    gc.collect()
+    memory_before = memory_bytes()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        outcomes = list(pool.map(
+            lambda number: run_session(number, endpoint, files, questions, args.script_timeout, args.upload_timeout),
+            range(level)
+        ))
+    wall = time.perf_counter() - started
+
+    # Measured while every session and its documents are still alive
+    memory_after = memory_bytes()
+    results = [result for result, _ in outcomes]
+    del outcomes
+    gc.collect()
+
+    completed = [result for result in results if result['ok']]
+    record = {
+        'sessions': level,
+        'completed': len(completed),
+        'error_rate': 1 - len(completed) / level,
+        'wall_seconds': wall,
+        'sessions_per_minute': len(completed) * 60 / wall,
+        'memory_per_session_mb': max(0, memory_after - memory_before) / level / 1024 / 1024,
+        'memory_mb': memory_after / 1024 / 1024,
+        'errors': sorted({error for result in results for error in result['errors']})[:20],
+    }
+    samples = {
+        'upload': [result['latency']['upload'] for result in results if 'upload' in result['latency']],
+        'chat': [latency for result in results for latency in result['chat']],
+        'generate_all': [result['latency']['generate_all'] for result in results if 'generate_all' in result['latency']],
+        'session': [result['latency']['session'] for result in completed],
+    }
+    for name, values in samples.items():
+        record[name] = {
+            'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+            'max': max(values) if values else None,
+        }
+    return record
+
+
+def find_saturation(levels):
+    """The first level at which adding sessions stopped adding throughput, or None."""
+    for previous, current in zip(levels, levels[1:]):
+        if current['error_rate'] > MAX_ERROR_RATE:
+            return current['sessions']
+        if current['sessions_per_minute'] < previous['sessions_per_minute'] * SATURATION_GAIN:
+            return current['sessions']
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent simulated sessions through the app")
+    parser.add_argument("--sessions", nargs="+", type=int, default=[1, 2, 4, 8], help="Concurrent sessions per level")
+    parser.add_argument("--types", nargs="+", choices=FIXTURE_TYPES, default=['pdf', 'docx', 'xlsx', 'csv'])
+    parser.add_argument("--size", choices=list(SIZES), default='small')
+    parser.add_argument("--questions", type=int, default=2, help="Chat questions per session")
+    parser.add_argument("--script-timeout", type=float, default=300, help="Seconds a single script run may take")
+    parser.add_argument("--upload-timeout", type=float, default=300)
+    parser.add_argument("--with-caches", action="store_true", help="Keep the conversion and response caches enabled")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure memory per session with tracemalloc; slower, but resident memory rarely shrinks between levels")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/load-<timestamp>.json)")
+    parser.add_argument("--mock-latency", type=float, default=0.5)
+    parser.add_argument("--mock-tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--mock-prefill-tokens-per-second", type=float, default=20000.0)
+    parser.add_argument("--mock-completion-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    # Every run starts cold; read before the app's modules are imported
+    os.environ.setdefault("INDIEAPP_CACHE_DIR", tempfile.mkdtemp(prefix="indieapp-load-"))
+    if not args.with_caches:
+        os.environ["INDIEAPP_CONVERSION_CACHE_MB"] = "0"
+        os.environ["INDIEAPP_RESPONSE_CACHE_MB"] = "0"
+
+    files = []
+    for file_type in args.types:
+        try:
+            files.append(generate_fixture(file_type, args.size))
+        except ImportError as e:
+            print(f"Skipping {file_type}: {e.name} is not installed")
+    questions = (QUESTIONS * args.questions)[:args.questions]
+
+    mock = MockSettings(args.mock_latency, args.mock_tokens_per_second, args.mock_prefill_tokens_per_second, args.mock_completion_tokens)
+    server, endpoint = start_server(mock)
+    levels = []
+    try:
+        # Imports, the process pool and the connection pool are paid once, outside the measurements
+        print("Warming up...", flush=True)
+        warm_up, _ = run_session("warm-up", endpoint, files, questions[:1], args.script_timeout, args.upload_timeout)
+        for error in warm_up['errors'][:3]:
+            print(f"  ! {error}")
+        if args.trace_memory:
+            tracemalloc.start()
+
+        for level in args.sessions:
+            print(f"Running {level} concurrent sessions...", flush=True)
+            record = run_level(level, endpoint, files, questions, args)
+            levels.append(record)
+            print(
+                f"  {record['completed']}/{level} completed in {record['wall_seconds']:.1f}s · "
+                f"{record['sessions_per_minute']:.1f} sessions/min · "
+                f"chat p95 {record['chat']['p95'] or 0:.2f}s · generate p95 {record['generate_all']['p95'] or 0:.2f}s · "
+                f"{record['memory_per_session_mb']:.1f} MB/session",
+                flush=True
+            )
+            for error in record['errors'][:3]:
+                print(f"  ! {error}")
+    finally:
+        server.shutdown()
+
+    saturation = find_saturation(levels)
+    report = {
+        'started_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'cpu_count': os.cpu_count(),
+        'arguments': vars(args),
+        'files': [{'name': name, 'bytes': len(data)} for name, data in files],
+        'memory': "tracemalloc" if args.trace_memory else "resident",
+        'mock_requests': server.state.requests,
+        'levels': levels,
+        'saturation_sessions': saturation,
+        'median_memory_per_session_mb': statistics.median(record['memory_per_session_mb'] for record in levels) if levels else None,
+    }
+    if saturation is None:
+        print("No saturation within the tested levels")
+    else:
+        print(f"Saturated at {saturation} concurrent sessions")
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("load-%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Local stand-in for the Azure OpenAI chat completions endpoint
+
+Run it with python -m benchmarks.mock_server and point the app's Settings at
+the printed endpoint (any API key works). Replies are filler text; only the
+timing and token accounting resemble the real service:
+
+- time to first token = latency + uncached prompt tokens / prefill rate
+- completion tokens stream at the configured token rate
+- prompts that share a prefix of at least 1024 tokens with a recent prompt
+  report the shared part as cached tokens, like provider prefix caching
+- with a requests-per-minute quota, requests over it get a 429 with a
+  retry-after header, like a deployment at its rate limit
+"""
+
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Provider prefix caching starts at 1024 tokens and grows in 128-token steps
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+RECENT_PROMPTS = 64
+
+FILLER = "The proposed venture addresses a clear customer need with a focused offering and sustainable revenue model".split()
+
+
+def _shared_prefix(a, b):
+    # Binary search on slice comparisons, which run in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _tokens(text):
+    # Same ~4 characters per token estimate the app uses without tiktoken
+    return (len(text) + 3) // 4
+
+
+class MockSettings:
+    def __init__(self, latency=0.2, tokens_per_second=100.0, prefill_tokens_per_second=20000.0,
+                 completion_tokens=200, error_rate=0.0, requests_per_minute=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+
+
+class MockState:
+    def __init__(self, settings):
+        self.settings = settings
+        self.requests = 0
+        self._recent = deque(maxlen=RECENT_PROMPTS)
+        self._admitted = deque()
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def retry_after(self):
+        """Seconds until a request fits in the requests-per-minute quota, 0 if it does now (and it is counted)."""
+        quota = self.settings.requests_per_minute
+        if not quota:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            while self._admitted and now - self._admitted[0] >= 60:
+                self._admitted.popleft()
+            if len(self._admitted) >= quota:
+                return 60 - (now - self._admitted[0])
+            self._admitted.append(now)
+            return 0
+
+    def cached_tokens(self, prompt):
+        with self._lock:
+            shared = max((_shared_prefix(previous, prompt) for previous in self._recent), default=0)
+            self._recent.append(prompt)
+
+        shared_tokens = shared // 4
+        if shared_tokens < CACHE_MIN_TOKENS:
+            return 0
+        return shared_tokens - shared_tokens % CACHE_STEP_TOKENS
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockAzureOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        # The app's warm-up request only wants a connection
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        state = self.server.state
+        settings = state.settings
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"code": "NotFound", "message": f"Unknown path {self.path}"}})
+
+        number = state.next_request()
+        if settings.error_rate and number % max(1, round(1 / settings.error_rate)) == 0:
+            return self._send_json(500, {"error": {"code": "InternalServerError", "message": "Simulated failure"}})
+        retry_after = state.retry_after()
+        if retry_after:
+            return self._send_json(429, {"error": {"code": "429", "message": "Rate limit of the simulated deployment exceeded"}},
+                                   {"retry-after": str(int(retry_after) + 1), "retry-after-ms": str(int(retry_after * 1000))})
+
+        prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+        prompt_tokens = _tokens(prompt)
+        cached_tokens = state.cached_tokens(prompt)
+        completion_tokens = min(settings.completion_tokens, body.get("max_tokens") or settings.completion_tokens)
+
+        time.sleep(settings.latency + (prompt_tokens - cached_tokens) / settings.prefill_tokens_per_second)
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        words = [FILLER[index % len(FILLER)] for index in range(completion_tokens)]
+        response_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            self._stream(response_id, body.get("model"), words, usage if include_usage else None)
+        else:
+            time.sleep(completion_tokens / settings.tokens_per_second)
+            self._send_json(200, {
+                "id": response_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _stream(self, response_id, model, words, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(payload):
+            self.wfile.write(f"data: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                "id": response_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        interval = 1 / self.server.state.settings.tokens_per_second
+        try:
+            send(chunk({"role": "assistant", "content": ""}))
+            for index, word in enumerate(words):
+                send(chunk({"content": word if index == 0 else " " + word}))
+                time.sleep(interval)
+            send(chunk({}, "stop"))
+            if usage is not None:
+                send(json.dumps({"id": response_id, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+            send("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. the user pressed stop
+            pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(settings=None, host="127.0.0.1", port=0):
+    """Serve in a background thread. Returns (server, endpoint); call server.shutdown() when done."""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(settings or MockSettings())
+    threading.Thread(target=server.serve_forever, name="mock-azure-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure OpenAI chat completions endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Completion token rate")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=20000.0, help="Rate at which uncached prompt tokens delay the first token")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Tokens per reply, capped by max_tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail with a 500")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Answer 429 to requests over this quota (default: no quota)")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.tokens_per_second, args.prefill_tokens_per_second,
+                            args.completion_tokens, args.error_rate, args.requests_per_minute)
+    server, endpoint = start_server(settings, args.host, args.port)
+    print(f"Mock Azure OpenAI endpoint: {endpoint} (any API key and deployment name work)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
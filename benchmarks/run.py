@@ -0,0 +1,283 @@
+"""
+Benchmark suite: conversion, context assembly, preview rendering and end-to-end LLM calls
+
+Run from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --suites conversion --sizes small medium large --repeat 5
+
+Results are written as JSON to benchmarks/results/ (or --output) so runs can
+be compared over time. The end-to-end suite talks to the bundled mock
+endpoint, never to Azure.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from concurrent.futures import as_completed
+
+from benchmarks.fixtures import FIXTURE_TYPES, SIZES, generate_fixture, generate_markdown
+from benchmarks.mock_server import MockSettings, start_server
+
+SUITES = ['conversion', 'context', 'preview', 'e2e']
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DOCUMENTS_PER_SESSION = 10
+
+
+def measure(function, repeat):
+    """Call function repeat times and return timing stats in seconds, plus its last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return {
+        'runs': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+    }, result
+
+
+def bench_conversion(sizes, repeat):
+    from conversion import _convert_in_worker, convert_files
+
+    records = []
+    for size in sizes:
+        files = []
+        for file_type in FIXTURE_TYPES:
+            try:
+                filename, data = generate_fixture(file_type, size)
+            except ImportError as e:
+                records.append({'type': file_type, 'size': size, 'skipped': f"writer not installed: {e.name}"})
+                continue
+            files.append((filename, data))
+
+            # MarkItDown alone, in this process, after a warm-up conversion
+            _convert_in_worker(filename, data)
+            timing, markdown = measure(lambda: _convert_in_worker(filename, data), repeat)
+            records.append({
+                'type': file_type,
+                'size': size,
+                'input_bytes': len(data),
+                'output_chars': len(markdown),
+                'seconds': timing,
+                'mb_per_second': len(data) / 1024 / 1024 / timing['median'],
+            })
+
+        # The whole pipeline as an upload uses it: process pool, no cache
+        timing, (converted, errors) = measure(lambda: convert_files(files, use_cache=False), repeat)
+        records.append({
+            'type': 'all (process pool)',
+            'size': size,
+            'files': len(files),
+            'input_bytes': sum(len(data) for _, data in files),
+            'errors': sorted(errors),
+            'seconds': timing,
+            'files_per_second': len(files) / timing['median'],
+        })
+    return records
+
+
+def _session_documents(size):
+    from doc_store import DocumentStore
+
+    documents = DocumentStore()
+    markdown = generate_markdown(size)
+    for index in range(DOCUMENTS_PER_SESSION):
+        documents[f"document-{index + 1}.md"] = markdown
+    return documents
+
+
+def bench_context(sizes, repeat):
+    from context import DocumentContext, assemble_context, count_tokens
+    from retrieval import RetrievalIndex
+
+    records = []
+    for size in sizes:
+        documents = _session_documents(size)
+        total_chars = sum(len(documents[name]) for name in documents)
+
+        def cold_assembly():
+            return assemble_context([(name, documents[name]) for name in documents], 'business_plan')
+
+        def warm_assembly():
+            return document_context.assemble('business_plan')
+
+        document_context = DocumentContext(documents)
+        document_context.assemble('business_plan')
+
+        def build_index():
+            index = RetrievalIndex()
+            for name in documents:
+                index.add_document(name, documents[name])
+            return index
+
+        cases = [
+            ('count_tokens', lambda: sum(count_tokens(documents[name]) for name in documents)),
+            ('assemble_context (cold)', cold_assembly),
+            ('DocumentContext.assemble (memoized)', warm_assembly),
+            ('RetrievalIndex build', build_index),
+        ]
+        for name, function in cases:
+            timing, _ = measure(function, repeat)
+            records.append({'case': name, 'size': size, 'documents': len(documents), 'chars': total_chars, 'seconds': timing})
+
+        index = build_index()
+        timing, _ = measure(lambda: index.search("pricing strategy for new customer segments", documents), repeat)
+        records.append({'case': 'RetrievalIndex search', 'size': size, 'documents': len(documents), 'chars': total_chars, 'seconds': timing})
+    return records
+
+
+def bench_preview(sizes, repeat):
+    from preview import PreviewCache
+
+    records = []
+    for size in sizes:
+        documents = _session_documents(size)
+        filename = next(iter(documents))
+
+        def cold_page():
+            return PreviewCache().page(filename, documents, 1)
+
+        cache = PreviewCache()
+        cache.page(filename, documents, 1)
+
+        for name, function in [
+            ('stats (cold)', lambda: PreviewCache().stats(filename, documents)),
+            ('first page (cold)', cold_page),
+            ('first page (cached)', lambda: cache.page(filename, documents, 1)),
+            ('all stats (cold)', lambda: [PreviewCache().stats(name, documents) for name in documents]),
+        ]:
+            timing, _ = measure(function, repeat)
+            records.append({'case': name, 'size': size, 'chars': len(documents[filename]), 'seconds': timing})
+    return records
+
+
+def bench_e2e(sizes, repeat, mock):
+    from clients import get_client
+    from context import CALL_SITES, DocumentContext
+    from llm import ChatStream, cached_completion, run_async, stream_options
+    from prompts import get_business_canvas_prompt, get_value_proposition_prompt
+
+    api_version = "2024-10-21"
+    server, endpoint = start_server(mock)
+    try:
+        client = get_client(endpoint, "benchmark", api_version)
+        async_client = get_client(endpoint, "benchmark", api_version, asynchronous=True)
+
+        records = []
+        for size in sizes:
+            documents = _session_documents(size)
+            document_context = DocumentContext(documents)
+
+            chats = []
+            for _ in range(repeat):
+                stream = ChatStream(
+                    client,
+                    model="benchmark",
+                    messages=[{"role": "system", "content": "You are a helpful assistant."},
+                              {"role": "user", "content": documents["document-1.md"][:6000] + "\n\nQuestion: what is the pricing?"}],
+                    max_tokens=CALL_SITES['chat']['max_tokens'],
+                    **stream_options(api_version)
+                )
+                for _ in stream:
+                    pass
+                chats.append(stream)
+            records.append({
+                'case': 'chat (streamed)',
+                'size': size,
+                'time_to_first_token': statistics.median(stream.time_to_first_token for stream in chats),
+                'total_latency': statistics.median(stream.total_latency for stream in chats),
+            })
+
+            # Both canvases at once, as "Generate All" does; later rounds hit the prompt cache
+            for round_number in range(repeat):
+                started = time.perf_counter()
+                futures = {}
+                for site, builder in [('business_plan', get_business_canvas_prompt), ('value_proposition', get_value_proposition_prompt)]:
+                    context = document_context.assemble(site, reserved_text=builder(""), header="\n\nCONTEXT FROM UPLOADED FILES:\n")
+                    future = run_async(cached_completion(
+                        async_client,
+                        regenerate=True,
+                        model="benchmark",
+                        messages=[{"role": "user", "content": builder(context.text)}],
+                        max_tokens=CALL_SITES[site]['max_tokens']
+                    ))
+                    futures[future] = (site, time.perf_counter())
+
+                latencies = {}
+                for future in as_completed(futures):
+                    site, submitted = futures[future]
+                    future.result()
+                    latencies[site] = time.perf_counter() - submitted
+                records.append({
+                    'case': 'generate all',
+                    'size': size,
+                    'round': round_number + 1,
+                    'wall_seconds': time.perf_counter() - started,
+                    'latency': latencies,
+                })
+        return records
+    finally:
+        server.shutdown()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the IndieApp benchmark suite")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=SUITES)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--mock-latency", type=float, default=0.2)
+    parser.add_argument("--mock-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--mock-prefill-tokens-per-second", type=float, default=20000.0)
+    parser.add_argument("--mock-completion-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    mock = MockSettings(args.mock_latency, args.mock_tokens_per_second, args.mock_prefill_tokens_per_second, args.mock_completion_tokens)
+    runs = {
+        'conversion': lambda: bench_conversion(args.sizes, args.repeat),
+        'context': lambda: bench_context(args.sizes, args.repeat),
+        'preview': lambda: bench_preview(args.sizes, args.repeat),
+        'e2e': lambda: bench_e2e(args.sizes, args.repeat, mock),
+    }
+
+    report = {
+        'started_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'git_commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'arguments': vars(args),
+        'results': {},
+    }
+    for suite in args.suites:
+        print(f"Running {suite}...", flush=True)
+        started = time.perf_counter()
+        report['results'][suite] = runs[suite]()
+        print(f"  {len(report['results'][suite])} results in {time.perf_counter() - started:.1f}s", flush=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
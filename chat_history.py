@@ -0,0 +1,106 @@
+"""
+Multi-turn chat history with rolling summaries of older turns
+"""
+
+import time
+import threading
+from context import count_tokens
+from llm import run_async, record_call, acreate
+
+# Messages at the end of the conversation that are always sent verbatim
+KEEP_RECENT_MESSAGES = 6
+# Older, not yet summarized messages beyond this many tokens trigger a compaction
+COMPACTION_THRESHOLD = 1500
+# Hard cap on the verbatim history sent with a turn
+MAX_HISTORY_TOKENS = 3000
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant about "
+    "the user's uploaded files. Merge the previous summary with the new messages into one "
+    "concise summary. Keep facts, figures, decisions and open questions; drop pleasantries. "
+    "Answer with the summary only."
+)
+
+
+class ChatHistory:
+    """
+    The part of st.session_state.messages that is sent with each new turn.
+
+    Older messages are folded into a rolling summary by a background request,
+    so a turn never waits for compaction. Until a summary is ready, the
+    verbatim history is trimmed from the oldest end to stay within budget.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        # Number of leading messages already folded into the summary
+        self.summarized_count = 0
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    def build(self, messages):
+        """Chat messages to send before the new question, given all previous messages."""
+        with self._lock:
+            summary = self.summary
+            recent = messages[self.summarized_count:]
+
+        history = []
+        tokens = 0
+        for message in reversed(recent):
+            tokens += count_tokens(message["content"])
+            if history and tokens > MAX_HISTORY_TOKENS:
+                break
+            history.append({"role": message["role"], "content": message["content"]})
+        history.reverse()
+
+        if summary:
+            history.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        return history
+
+    def maybe_compact(self, messages, client, deployment_name, max_tokens, session=None):
+        """Start summarizing older messages in the background if they have grown past the threshold."""
+        with self._lock:
+            if self._compacting:
+                return
+            end = len(messages) - KEEP_RECENT_MESSAGES
+            older = messages[self.summarized_count:end]
+            if not older or sum(count_tokens(message["content"]) for message in older) < COMPACTION_THRESHOLD:
+                return
+            self._compacting = True
+            previous_summary = self.summary
+
+        started = time.perf_counter()
+        transcript = "\n\n".join(f"{message['role'].upper()}: {message['content']}" for message in older)
+        summary_messages = [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": f"PREVIOUS SUMMARY:\n{previous_summary or '(none)'}\n\nNEW MESSAGES:\n{transcript}"}
+        ]
+        future = run_async(acreate(
+            client,
+            'chat_summary',
+            session,
+            model=deployment_name,
+            messages=summary_messages,
+            temperature=0.2,
+            max_tokens=max_tokens
+        ))
+
+        def done(future):
+            error = future.exception()
+            response, waited = future.result() if error is None else (None, 0.0)
+            record_call(
+                'chat_summary',
+                time.perf_counter() - started - waited,
+                usage=getattr(response, 'usage', None),
+                error=error.__class__.__name__ if error is not None else None,
+                messages=summary_messages,
+                text=response.choices[0].message.content if response is not None else ""
+            )
+            with self._lock:
+                self._compacting = False
+                # On failure the messages stay verbatim and the next turn tries again
+                if error is None:
+                    self.summary = response.choices[0].message.content or previous_summary
+                    self.summarized_count = end
+
+        future.add_done_callback(done)
@@ -0,0 +1,116 @@
+"""
+Process-wide Azure OpenAI clients shared by all sessions
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# The OpenAI SDK takes most of a second to import, so it is only loaded
+# when the first client is created (or by prewarm() in the background)
+
+MAX_CONNECTIONS = int(os.environ.get("INDIEAPP_HTTP_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("INDIEAPP_HTTP_MAX_KEEPALIVE", 20))
+KEEPALIVE_EXPIRY = float(os.environ.get("INDIEAPP_HTTP_KEEPALIVE_EXPIRY", 120))
+CONNECT_TIMEOUT = 10.0
+# Generations of several thousand tokens can take minutes
+READ_TIMEOUT = 300.0
+# Settings changes and connection tests each add a client; the least
+# recently used ones are dropped beyond this many
+MAX_CLIENTS = int(os.environ.get("INDIEAPP_MAX_CLIENTS", 32))
+
+_lock = threading.Lock()
+_clients = OrderedDict()
+_http_client = None
+_async_http_client = None
+
+
+def _limits():
+    # The SDK's pooled clients are built on httpx2 and only accept its Limits
+    import httpx2
+
+    return httpx2.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+
+def _timeout():
+    from openai import Timeout
+
+    return Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _get_http_client(asynchronous):
+    global _http_client, _async_http_client
+    from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
+
+    if asynchronous:
+        if _async_http_client is None:
+            _async_http_client = DefaultAsyncHttpxClient(limits=_limits())
+        return _async_http_client
+
+    if _http_client is None:
+        _http_client = DefaultHttpxClient(limits=_limits())
+    return _http_client
+
+
+def key_fingerprint(api_key):
+    # Registry keys never hold the raw secret
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_client(endpoint, api_key, api_version, asynchronous=False):
+    """
+    Return the shared client for these settings, creating it on first use.
+
+    All clients of the same kind share one connection pool, so sessions
+    with identical settings reuse warm keep-alive connections. Evicted
+    clients are dropped but not closed: closing one would close the shared
+    pool, and a session still holding one can finish its requests.
+    """
+    if not (endpoint and api_key):
+        return None
+
+    registry_key = (endpoint.rstrip('/'), api_version, key_fingerprint(api_key), asynchronous)
+    with _lock:
+        client = _clients.get(registry_key)
+        if client is not None:
+            _clients.move_to_end(registry_key)
+        else:
+            from openai import AzureOpenAI, AsyncAzureOpenAI
+
+            client_class = AsyncAzureOpenAI if asynchronous else AzureOpenAI
+            client = client_class(
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                http_client=_get_http_client(asynchronous),
+                timeout=_timeout(),
+                # Retries go back through the rate limiter's queue instead (see rate_limit.py)
+                max_retries=0
+            )
+            _clients[registry_key] = client
+            while len(_clients) > MAX_CLIENTS:
+                _clients.popitem(last=False)
+        return client
+
+
+def warm_up(endpoint, api_key, api_version):
+    """Create the clients and open a pooled connection to the endpoint in the background."""
+    client = get_client(endpoint, api_key, api_version)
+    get_client(endpoint, api_key, api_version, asynchronous=True)
+    if client is None:
+        return
+
+    def connect():
+        try:
+            # Any response will do: the point is the TLS handshake and a kept-alive connection
+            _get_http_client(False).head(endpoint)
+        except Exception:
+            # Warming up is best effort; real requests report their own errors
+            pass
+
+    threading.Thread(target=connect, name="azure-openai-warm-up", daemon=True).start()
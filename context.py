@@ -0,0 +1,248 @@
+"""
+Token-budget-aware assembly of uploaded file context for LLM calls
+"""
+
+import os
+import time
+import threading
+import metrics
+
+CONTEXT_WINDOW = int(os.environ.get("INDIEAPP_CONTEXT_WINDOW", 128000))
+
+# Tokens kept free for message framing and counting error
+SAFETY_MARGIN = 500
+
+# Completion size and maximum context size for every place that calls the model.
+# "proportional" shrinks every document by the same ratio; "priority" keeps
+# documents in the given order and drops whatever no longer fits.
+CALL_SITES = {
+    'chat': {'max_tokens': 1000, 'context_tokens': 6000, 'policy': 'priority'},
+    'chat_summary': {'max_tokens': 500, 'context_tokens': 0, 'policy': 'priority'},
+    'business_plan': {'max_tokens': 6000, 'context_tokens': 60000, 'policy': 'proportional'},
+    'value_proposition': {'max_tokens': 3000, 'context_tokens': 60000, 'policy': 'proportional'},
+}
+
+TRUNCATION_MARKER = "\n[... truncated to fit the token budget ...]"
+DOCUMENT_TEMPLATE = "File: {name}\n{text}"
+
+# Loaded on first use: importing tiktoken and reading its ranks takes a while
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """The tiktoken encoding, or None when tiktoken is not available."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Without tiktoken, assume the usual ~4 characters per token
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+    return text[:max_tokens * 4]
+
+
+class AssembledContext:
+    """The context text for one call plus a report of what had to be cut."""
+
+    def __init__(self, text, tokens, budget, items):
+        self.text = text
+        self.tokens = tokens
+        self.budget = budget
+        # (name, original tokens, kept tokens) for every input document
+        self.items = items
+
+    @property
+    def dropped(self):
+        return [name for name, original, kept in self.items if kept == 0 and original > 0]
+
+    @property
+    def truncated(self):
+        return [name for name, original, kept in self.items if 0 < kept < original]
+
+    def summary(self):
+        """A one-line description of what was left out, or "" if everything fit."""
+        parts = []
+        if self.truncated:
+            parts.append(f"truncated {', '.join(self.truncated)}")
+        if self.dropped:
+            parts.append(f"dropped {', '.join(self.dropped)}")
+        if not parts:
+            return ""
+        return f"Context limited to {self.budget:,} tokens: " + "; ".join(parts)
+
+
+def context_budget(call_site, reserved_text=""):
+    """Tokens available for context once the prompt and the completion are accounted for."""
+    site = CALL_SITES[call_site]
+    available = CONTEXT_WINDOW - site['max_tokens'] - count_tokens(reserved_text) - SAFETY_MARGIN
+    return max(0, min(site['context_tokens'], available))
+
+
+def assemble_context(documents, call_site, reserved_text="", header="", separator="\n\n",
+                     template=DOCUMENT_TEMPLATE):
+    """
+    Fit (name, text) documents into the token budget of a call site.
+
+    Each document is rendered with template, which may use {number}, {name}
+    and {text}. reserved_text is everything else sent in the same request
+    (instructions, the user's question) so that it is counted against the
+    window as well.
+    """
+    names = []
+    segments = []
+    for number, (name, text) in enumerate(documents, start=1):
+        names.append(name)
+        segments.append(template.format(number=number, name=name, text=text))
+
+    def segment_text(index, max_tokens):
+        if max_tokens is None:
+            return segments[index]
+        return truncate_to_tokens(segments[index], max_tokens)
+
+    return _fit(names, call_site, reserved_text, header, separator,
+                lambda index: count_tokens(segments[index]), segment_text)
+
+
+def _fit(names, call_site, reserved_text, header, separator, segment_tokens, segment_text):
+    """
+    The budgeting behind assemble_context, for documents read through callbacks.
+
+    segment_tokens(index) is the token count of the index-th rendered
+    document and segment_text(index, max_tokens) its text, cut to at most
+    max_tokens tokens unless max_tokens is None. Only the text that is
+    kept is ever asked for.
+    """
+    started = time.perf_counter()
+    budget = context_budget(call_site, reserved_text)
+    policy = CALL_SITES[call_site]['policy']
+
+    sizes = [segment_tokens(index) for index in range(len(names))]
+    fixed = count_tokens(header) + count_tokens(separator) * max(0, len(names) - 1)
+    available = max(0, budget - fixed)
+
+    if sum(sizes) <= available:
+        limits = sizes
+    elif policy == 'proportional':
+        ratio = available / sum(sizes)
+        limits = [int(size * ratio) for size in sizes]
+    else:
+        limits = []
+        for size in sizes:
+            limits.append(min(size, available))
+            available -= limits[-1]
+
+    marker_tokens = count_tokens(TRUNCATION_MARKER)
+    kept_segments = []
+    items = []
+    for index, (name, size, limit) in enumerate(zip(names, sizes, limits)):
+        if limit >= size:
+            kept_segments.append(segment_text(index, None))
+            items.append((name, size, size))
+        elif limit > marker_tokens * 4:
+            kept_segments.append(segment_text(index, limit - marker_tokens) + TRUNCATION_MARKER)
+            items.append((name, size, limit))
+        else:
+            items.append((name, size, 0))
+
+    text = header + separator.join(kept_segments) if kept_segments else ""
+    assembled = AssembledContext(text, count_tokens(text), budget, items)
+    metrics.record(
+        "context",
+        call_site,
+        time.perf_counter() - started,
+        input_tokens=sum(sizes),
+        output_tokens=assembled.tokens,
+        documents=len(items),
+        dropped=len(assembled.dropped),
+        truncated=len(assembled.truncated)
+    )
+    return assembled
+
+
+class DocumentContext:
+    """
+    Memoized generation context over the uploaded files in a DocumentStore.
+
+    Token counts are kept per file and assembled contexts per call site, so
+    a rerun that did not change the files costs a dictionary lookup. Call
+    invalidate() whenever a file is added, replaced or removed. Documents
+    are counted part by part, and a document that has to be truncated is
+    only read as far as the kept tokens reach, so a large spilled document
+    is never loaded whole.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.version = 0
+        self._tokens = {}
+        self._assembled = {}
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._tokens.clear()
+        else:
+            self._tokens.pop(name, None)
+        self._assembled.clear()
+        self.version += 1
+
+    def _segment_tokens(self, name):
+        tokens = self._tokens.get(name)
+        if tokens is None:
+            label = DOCUMENT_TEMPLATE.format(name=name, text="")
+            tokens = count_tokens(label) + sum(count_tokens(part) for part in self.documents.parts(name))
+            self._tokens[name] = tokens
+        return tokens
+
+    def _segment_text(self, name, max_tokens):
+        label = DOCUMENT_TEMPLATE.format(name=name, text="")
+        if max_tokens is None:
+            return label + self.documents[name]
+        # Read a prefix that should hold max_tokens, and more only if it did not
+        total = self.documents.size(name)[0]
+        chars = max_tokens * 4
+        while True:
+            segment = label + self.documents.read(name, 0, chars)
+            truncated = truncate_to_tokens(segment, max_tokens)
+            if len(truncated) < len(segment) or chars >= total:
+                return truncated
+            chars *= 2
+
+    def assemble(self, call_site, reserved_text="", header=""):
+        key = (call_site, reserved_text, header)
+        assembled = self._assembled.get(key)
+        if assembled is None:
+            names = list(self.documents)
+            assembled = _fit(
+                names,
+                call_site,
+                reserved_text,
+                header,
+                "\n\n",
+                lambda index: self._segment_tokens(names[index]),
+                lambda index, max_tokens: self._segment_text(names[index], max_tokens)
+            )
+            self._assembled[key] = assembled
+        return assembled
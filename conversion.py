@@ -0,0 +1,378 @@
+"""
+Document conversion engine for uploaded files
+"""
+
+import io
+import os
+import time
+import hashlib
+import tempfile
+import itertools
+import threading
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from importlib.metadata import version, PackageNotFoundError
+from disk_cache import DiskCache
+import metrics
+
+DEFAULT_WORKERS = int(os.environ.get("INDIEAPP_CONVERSION_WORKERS", 0)) or os.cpu_count() or 1
+# Started ahead of the first upload; the pool adds the rest as uploads need them
+PREWARM_WORKERS = min(int(os.environ.get("INDIEAPP_PREWARM_WORKERS", 2)), DEFAULT_WORKERS)
+DEFAULT_TIMEOUT = float(os.environ.get("INDIEAPP_CONVERSION_TIMEOUT", 120))
+# Tries per file when its worker process dies
+MAX_ATTEMPTS = 2
+CACHE_MAX_MB = float(os.environ.get("INDIEAPP_CONVERSION_CACHE_MB", 512))
+
+# File types accepted for upload and batch processing
+SUPPORTED_TYPES = ['pdf', 'docx', 'txt', 'md', 'xlsx', 'pptx', 'html', 'csv']
+
+# Bump when the conversion pipeline changes in a way that alters its output
+PIPELINE_REVISION = 1
+
+# The pool is shared by every session in the server process
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+# Pools killed on purpose because a call ran too long; the other calls they
+# were running did nothing wrong and are resubmitted without using up a try
+_killed_executors = weakref.WeakSet()
+
+# Workers report when they actually pick a call up, so calls still waiting
+# in the pool's call queue are not timed
+_call_tokens = itertools.count()
+_call_started = {}
+_started_queue = None
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# One MarkItDown instance per worker process, created on first use
+_md = None
+
+
+def converter_version():
+    try:
+        markitdown_version = version("markitdown")
+    except PackageNotFoundError:
+        markitdown_version = "unknown"
+    return f"markitdown-{markitdown_version}/r{PIPELINE_REVISION}"
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache("conversions", max_bytes=int(CACHE_MAX_MB * 1024 * 1024))
+        return _cache
+
+
+def cache_key(filename, data):
+    # The extension is part of the key because it steers converter selection
+    extension = filename.split('.')[-1].lower()
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{converter_version()}:{extension}:{digest}"
+
+
+def _get_markitdown():
+    global _md
+    if _md is None:
+        from markitdown import MarkItDown
+        _md = MarkItDown()
+    return _md
+
+
+def _convert_from_disk(md, filename, data):
+    tmp_file_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{filename.split('.')[-1]}") as tmp_file:
+            tmp_file_path = tmp_file.name
+            tmp_file.write(data)
+        return md.convert(tmp_file_path).text_content
+    finally:
+        if tmp_file_path is not None:
+            os.unlink(tmp_file_path)
+
+
+def _convert_in_worker(filename, data):
+    from markitdown import StreamInfo, UnsupportedFormatException
+
+    md = _get_markitdown()
+    stream_info = StreamInfo(extension=f".{filename.split('.')[-1].lower()}", filename=filename)
+
+    try:
+        # BytesIO over an immutable bytes object shares its buffer, so this is zero-copy
+        return md.convert_stream(io.BytesIO(data), stream_info=stream_info).text_content
+    except UnsupportedFormatException:
+        # Some converters only recognise a document from a real path on disk
+        return _convert_from_disk(md, filename, data)
+
+
+def _warm_worker():
+    _get_markitdown()
+    return os.getpid()
+
+
+def _init_worker(started_queue):
+    global _started_queue
+    _started_queue = started_queue
+
+
+def _call_reporting_start(token, function, *args):
+    _started_queue.put(token)
+    return function(*args)
+
+
+def _collect_starts(started_queue):
+    # One thread per pool; stopped by None once the pool is shut down
+    while True:
+        token = started_queue.get()
+        if token is None:
+            return
+        _call_started[token] = time.monotonic()
+
+
+def _submit_timed(executor, function, *args):
+    """Submit function(*args); returns (future, token) for _running_for()."""
+    token = next(_call_tokens)
+    return executor.submit(_call_reporting_start, token, function, *args), token
+
+
+def _running_for(token, now):
+    """Seconds since a worker picked the call up, or 0 while it waits in the queue."""
+    started = _call_started.get(token)
+    return now - started if started is not None else 0.0
+
+
+def _forget_call(token):
+    _call_started.pop(token, None)
+
+
+def warm_workers(count=None, max_workers=None):
+    """Start count conversion processes and load MarkItDown in them, waiting until they are ready."""
+    max_workers = max_workers or DEFAULT_WORKERS
+    count = min(count or PREWARM_WORKERS, max_workers)
+    executor = get_executor(max_workers)
+    futures = [executor.submit(_warm_worker) for _ in range(count)]
+    return len({future.result() for future in futures})
+
+
+def get_executor(max_workers=None):
+    global _executor, _executor_workers
+    max_workers = max_workers or DEFAULT_WORKERS
+
+    with _executor_lock:
+        if _executor is not None and _executor_workers != max_workers:
+            _shutdown(_executor)
+            _executor = None
+
+        if _executor is None:
+            # Spawn instead of fork: the Streamlit server process is multi-threaded
+            context = multiprocessing.get_context("spawn")
+            started_queue = context.SimpleQueue()
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(started_queue,)
+            )
+            _executor.started_queue = started_queue
+            threading.Thread(target=_collect_starts, args=(started_queue,), name="conversion-starts", daemon=True).start()
+            _executor_workers = max_workers
+        return _executor
+
+
+def _shutdown(executor):
+    executor.shutdown(wait=False, cancel_futures=True)
+    executor.started_queue.put(None)
+
+
+def _discard_executor(executor, killed=False):
+    # A worker stuck on a timed-out file can only be stopped by killing it,
+    # which takes the whole pool down with it
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+        if killed:
+            _killed_executors.add(executor)
+
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    _shutdown(executor)
+
+
+def _killed_by_timeout(executor):
+    with _executor_lock:
+        return executor in _killed_executors
+
+
+def convert_files(files, max_workers=None, timeout=None, on_result=None, use_cache=True):
+    """
+    Convert (filename, bytes) pairs to markdown in the process pool.
+
+    Files already in the conversion cache are answered without converting.
+    Returns (converted, errors) dicts keyed by filename. on_result, if given,
+    is called as on_result(filename, markdown, error) as each file finishes.
+    """
+    timeout = timeout or DEFAULT_TIMEOUT
+    cache = get_cache() if use_cache else None
+    converted = {}
+    errors = {}
+    keys = {}
+    sizes = {filename: len(data) for filename, data in files}
+    call_started = time.perf_counter()
+
+    def finish(filename, markdown=None, error=None, error_class=None, cached=False):
+        # Durations include the wait for a free worker, as the user experiences it
+        metrics.record(
+            "conversion",
+            os.path.splitext(filename)[1].lower().lstrip('.') or "unknown",
+            time.perf_counter() - call_started,
+            error=error_class if error is not None else None,
+            input_bytes=sizes.get(filename, 0),
+            output_bytes=len(markdown.encode('utf-8')) if markdown else 0,
+            cached=cached
+        )
+        if error is None:
+            converted[filename] = markdown
+            if cache is not None and filename in keys:
+                cache.set(keys.pop(filename), markdown)
+        else:
+            errors[filename] = error
+        if on_result:
+            on_result(filename, markdown, error)
+
+    remaining = []
+    for filename, data in files:
+        if cache is None:
+            remaining.append((filename, data))
+            continue
+
+        key = cache_key(filename, data)
+        markdown = cache.get(key)
+        if markdown is None:
+            keys[filename] = key
+            remaining.append((filename, data))
+        else:
+            finish(filename, markdown=markdown, cached=True)
+
+    attempts = {}
+    while remaining:
+        executor = get_executor(max_workers)
+        futures = {}
+        try:
+            for filename, data in remaining:
+                future, token = _submit_timed(executor, _convert_in_worker, filename, data)
+                futures[future] = (filename, data, token)
+        except (BrokenProcessPool, RuntimeError):
+            # Another caller shut this pool down between lookup and submit
+            for future, (_, _, token) in futures.items():
+                future.cancel()
+                _forget_call(token)
+            _discard_executor(executor)
+            continue
+        remaining = []
+        timed_out = False
+        broken = False
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                filename, data, token = futures[future]
+                _forget_call(token)
+                try:
+                    finish(filename, markdown=future.result())
+                except BrokenProcessPool as e:
+                    broken = True
+                    if _killed_by_timeout(executor):
+                        # Killed for someone else's file: this one did nothing wrong
+                        remaining.append((filename, data))
+                        continue
+                    attempts[filename] = attempts.get(filename, 0) + 1
+                    if attempts[filename] < MAX_ATTEMPTS:
+                        remaining.append((filename, data))
+                    else:
+                        finish(filename, error=f"Converter process crashed: {str(e)}", error_class=e.__class__.__name__)
+                except Exception as e:
+                    finish(filename, error=str(e) or e.__class__.__name__, error_class=e.__class__.__name__)
+
+            now = time.monotonic()
+            if any(_running_for(futures[future][2], now) > timeout for future in pending):
+                timed_out = True
+                break
+
+        if timed_out:
+            # Fail the files that ran too long, restart the pool and
+            # resubmit everything that had not finished yet
+            now = time.monotonic()
+            for future in pending:
+                filename, data, token = futures[future]
+                if _running_for(token, now) > timeout:
+                    finish(filename, error=f"Conversion timed out after {timeout:g}s", error_class="TimeoutError")
+                else:
+                    remaining.append((filename, data))
+                _forget_call(token)
+            _discard_executor(executor, killed=True)
+        elif broken:
+            _discard_executor(executor)
+
+    return converted, errors
+
+
+def run_in_pool(function, *args, timeout=None):
+    """
+    Call function(*args) in the shared process pool and return its result.
+
+    A call that runs longer than timeout takes the pool down with it, and
+    one whose worker crashed is tried once more. Calls that only went down
+    with a pool killed for another call's timeout are simply resubmitted.
+    """
+    timeout = timeout or DEFAULT_TIMEOUT
+    attempts = 0
+    while attempts < MAX_ATTEMPTS:
+        executor = get_executor()
+        try:
+            future, token = _submit_timed(executor, function, *args)
+        except (BrokenProcessPool, RuntimeError):
+            _discard_executor(executor)
+            attempts += 1
+            continue
+
+        try:
+            while not wait([future], timeout=0.25)[0]:
+                if _running_for(token, time.monotonic()) > timeout:
+                    _discard_executor(executor, killed=True)
+                    raise TimeoutError(f"Conversion timed out after {timeout:g}s")
+        finally:
+            _forget_call(token)
+
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            killed = _killed_by_timeout(executor)
+            _discard_executor(executor)
+            if not killed:
+                attempts += 1
+                if attempts == MAX_ATTEMPTS:
+                    raise
+    raise RuntimeError("The conversion process pool could not be started")
+
+
+def convert_to_file(filename, input_path, output_path, timeout=None):
+    """
+    Convert a large file on disk page by page in the process pool, writing markdown to output_path.
+
+    The output bypasses the conversion cache, which holds whole documents in
+    memory. Returns the number of characters written; raises on failure.
+    """
+    from ingest import STREAMING_TIMEOUT, stream_to_file
+
+    with metrics.timed("conversion", os.path.splitext(filename)[1].lower().lstrip('.') or "unknown",
+                       input_bytes=os.path.getsize(input_path), streamed=True) as values:
+        written = run_in_pool(stream_to_file, filename, input_path, output_path, timeout=timeout or STREAMING_TIMEOUT)
+        values['output_bytes'] = os.path.getsize(output_path)
+        return written
@@ -0,0 +1,288 @@
+"""
+Memory-budgeted storage for converted documents
+"""
+
+import os
+import mmap
+import zlib
+import time
+import tempfile
+import threading
+import weakref
+from collections.abc import MutableMapping
+
+# Documents up to this size stay as plain strings
+INLINE_LIMIT = 64 * 1024
+SESSION_BUDGET_MB = float(os.environ.get("INDIEAPP_SESSION_MEMORY_MB", 64))
+PROCESS_BUDGET_MB = float(os.environ.get("INDIEAPP_PROCESS_MEMORY_MB", 1024))
+
+# Rewrite a spill file once this share of it belongs to deleted documents
+COMPACT_RATIO = 0.5
+
+# Keyed by id(): mappings are unhashable
+_stores = weakref.WeakValueDictionary()
+_stores_lock = threading.Lock()
+
+
+class _Entry:
+    # Spilled documents are stored as (offset, length, compressed, characters) segments of the spill file
+    __slots__ = ('kind', 'value', 'segments', 'nchars', 'nbytes', 'last_access')
+
+    @property
+    def memory(self):
+        if self.kind == 'text':
+            return self.nbytes
+        if self.kind == 'zlib':
+            return len(self.value)
+        return 0
+
+
+class DocumentStore(MutableMapping):
+    """
+    A dict of filename -> markdown that keeps memory use within a budget.
+
+    Small documents are kept as strings and large ones zlib-compressed.
+    When the session or the whole process goes over its budget, the least
+    recently used documents are moved to a memory-mapped spill file.
+    Very large documents can be built with append(), which writes each part
+    straight to the spill file. Reads always return the original string;
+    size(), parts() and read() give a document's size, its text part by
+    part or a slice of it without loading the whole of a spilled document.
+    """
+
+    def __init__(self, budget_bytes=None):
+        self.budget_bytes = budget_bytes or int(SESSION_BUDGET_MB * 1024 * 1024)
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._spill_file = None
+        self._spill_map = None
+        self._spill_size = 0
+        self._spill_dead = 0
+
+        with _stores_lock:
+            _stores[id(self)] = self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def __getitem__(self, filename):
+        with self._lock:
+            entry = self._entries[filename]
+            entry.last_access = time.monotonic()
+
+            if entry.kind == 'text':
+                return entry.value
+            if entry.kind == 'zlib':
+                return zlib.decompress(entry.value).decode('utf-8')
+
+            return "".join(self._read_segment(segment) for segment in entry.segments)
+
+    def size(self, filename):
+        """(characters, UTF-8 bytes) of a document, without reading it."""
+        with self._lock:
+            entry = self._entries[filename]
+            return entry.nchars, entry.nbytes
+
+    def parts(self, filename):
+        """Yield a document's text in the parts it was stored in, reading one part at a time."""
+        with self._lock:
+            entry = self._entries[filename]
+            if entry.kind != 'disk':
+                yield self[filename]
+                return
+            count = len(entry.segments)
+        for index in range(count):
+            with self._lock:
+                # Stop if the document was replaced or deleted meanwhile
+                if self._entries.get(filename) is not entry:
+                    return
+                text = self._read_segment(entry.segments[index])
+            yield text
+
+    def read(self, filename, start=0, end=None):
+        """document[start:end], reading only the stored parts that overlap the slice."""
+        with self._lock:
+            entry = self._entries[filename]
+            if entry.kind != 'disk':
+                return self[filename][start:end]
+            entry.last_access = time.monotonic()
+            end = entry.nchars if end is None else min(end, entry.nchars)
+            pieces = []
+            position = 0
+            for segment in entry.segments:
+                chars = segment[3]
+                if position < end and position + chars > start:
+                    pieces.append(self._read_segment(segment)[max(0, start - position):end - position])
+                position += chars
+                if position >= end:
+                    break
+            return "".join(pieces)
+
+    def __setitem__(self, filename, content):
+        encoded = content.encode('utf-8')
+        entry = _Entry()
+        entry.nchars = len(content)
+        entry.nbytes = len(encoded)
+        entry.last_access = time.monotonic()
+        if entry.nbytes <= INLINE_LIMIT:
+            entry.kind, entry.value = 'text', content
+        else:
+            entry.kind, entry.value = 'zlib', zlib.compress(encoded, 6)
+
+        with self._lock:
+            if filename in self._entries:
+                self._discard(self._entries.pop(filename))
+            self._entries[filename] = entry
+        _enforce_budgets(self)
+
+    def append(self, filename, content):
+        """Add content to the end of a document, creating it if needed, without holding the document in memory."""
+        encoded = content.encode('utf-8')
+        data = zlib.compress(encoded, 6)
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                entry = _Entry()
+                entry.kind, entry.value, entry.segments, entry.nchars, entry.nbytes = 'disk', None, [], 0, 0
+                self._entries[filename] = entry
+            elif entry.kind != 'disk':
+                self._spill(entry)
+            entry.segments.append(self._append_spilled(data) + (True, len(content)))
+            entry.nchars += len(content)
+            entry.nbytes += len(encoded)
+            entry.last_access = time.monotonic()
+
+    def __delitem__(self, filename):
+        with self._lock:
+            self._discard(self._entries.pop(filename))
+            self._maybe_compact()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._close_spill()
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(entry.memory for entry in self._entries.values())
+
+    def usage(self):
+        with self._lock:
+            kinds = {'text': 0, 'zlib': 0, 'disk': 0}
+            for entry in self._entries.values():
+                kinds[entry.kind] += 1
+            return {
+                'documents': len(self._entries),
+                'memory_bytes': self.memory_usage(),
+                'disk_bytes': self._spill_size - self._spill_dead,
+                'budget_bytes': self.budget_bytes,
+                'inline': kinds['text'],
+                'compressed': kinds['zlib'],
+                'spilled': kinds['disk'],
+            }
+
+    def _discard(self, entry):
+        if entry.kind == 'disk':
+            self._spill_dead += sum(segment[1] for segment in entry.segments)
+
+    def spill_one(self):
+        """Move the least recently used in-memory document to disk. Returns the bytes freed."""
+        with self._lock:
+            # Empty documents free nothing, so they would end the spilling early
+            candidates = [entry for entry in self._entries.values() if entry.kind != 'disk' and entry.memory]
+            if not candidates:
+                return 0
+            return self._spill(min(candidates, key=lambda candidate: candidate.last_access))
+
+    def _spill(self, entry):
+        freed = entry.memory
+        if entry.kind == 'text':
+            data, compressed = entry.value.encode('utf-8'), False
+        else:
+            data, compressed = entry.value, True
+        entry.segments = [self._append_spilled(data) + (compressed, entry.nchars)]
+        entry.kind, entry.value = 'disk', None
+        return freed
+
+    def _append_spilled(self, data):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="indieapp-docs-")
+        offset = self._spill_size
+        os.pwrite(self._spill_file.fileno(), data, offset)
+        self._spill_size += len(data)
+        # The map no longer covers the whole file
+        self._spill_map = None
+        return offset, len(data)
+
+    def _read_segment(self, segment):
+        offset, length, compressed, _ = segment
+        data = self._read_spilled(offset, length)
+        return (zlib.decompress(data) if compressed else data).decode('utf-8')
+
+    def _read_spilled(self, offset, length):
+        if not length:
+            # The spill file may be empty, and an empty file cannot be mapped
+            return b""
+        if self._spill_map is None:
+            self._spill_map = mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._spill_map[offset:offset + length]
+
+    def _maybe_compact(self):
+        if not self._spill_size or self._spill_dead < self._spill_size * COMPACT_RATIO:
+            return
+
+        spilled = [entry for entry in self._entries.values() if entry.kind == 'disk']
+        chunks = [[(self._read_spilled(offset, length), compressed, chars) for offset, length, compressed, chars in entry.segments]
+                  for entry in spilled]
+        self._close_spill()
+        for entry, segments in zip(spilled, chunks):
+            entry.segments = [self._append_spilled(data) + (compressed, chars) for data, compressed, chars in segments]
+
+    def _close_spill(self):
+        if self._spill_map is not None:
+            self._spill_map.close()
+        if self._spill_file is not None:
+            self._spill_file.close()
+        self._spill_file = None
+        self._spill_map = None
+        self._spill_size = 0
+        self._spill_dead = 0
+
+
+def process_usage():
+    """Memory and disk used by every document store in this process."""
+    with _stores_lock:
+        stores = list(_stores.values())
+    usages = [store.usage() for store in stores]
+    return {
+        'sessions': len(usages),
+        'documents': sum(usage['documents'] for usage in usages),
+        'memory_bytes': sum(usage['memory_bytes'] for usage in usages),
+        'disk_bytes': sum(usage['disk_bytes'] for usage in usages),
+        'budget_bytes': int(PROCESS_BUDGET_MB * 1024 * 1024),
+    }
+
+
+def _enforce_budgets(store):
+    while store.memory_usage() > store.budget_bytes:
+        if not store.spill_one():
+            break
+
+    process_budget = int(PROCESS_BUDGET_MB * 1024 * 1024)
+    with _stores_lock:
+        stores = list(_stores.values())
+    total = sum(other.memory_usage() for other in stores)
+
+    # Over the process budget: spill from whichever sessions hold the most
+    while total > process_budget:
+        largest = max(stores, key=lambda other: other.memory_usage())
+        freed = largest.spill_one()
+        if not freed:
+            break
+        total -= freed
@@ -0,0 +1,80 @@
+"""
+Content hashes and filename aliases of a session's documents
+"""
+
+import os
+import hashlib
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """content_digest() of a file, read a chunk at a time."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DocumentNames:
+    """
+    Which document each uploaded content belongs to, and the filenames it was uploaded as.
+
+    Each distinct content is converted and stored once, under the first
+    filename it arrived with; uploading the same bytes again under another
+    name only adds an alias. A document is registered as soon as its
+    conversion is queued, so identical files uploaded together are also
+    converted once.
+    """
+
+    def __init__(self):
+        self._documents = {}
+        self._digests = {}
+        self._aliases = {}
+
+    def document_for(self, digest):
+        """The name of the document with this content, or None."""
+        return self._documents.get(digest)
+
+    def add(self, filename, digest):
+        """Register new content and return the name it is stored under."""
+        name = self._unique_name(filename)
+        self._documents[digest] = name
+        self._digests[name] = digest
+        self._aliases[name] = []
+        return name
+
+    def add_alias(self, name, filename):
+        if filename != name and filename not in self._aliases[name]:
+            self._aliases[name].append(filename)
+
+    def aliases(self, name):
+        """The other filenames a document was uploaded as."""
+        return list(self._aliases.get(name, []))
+
+    def remove(self, name):
+        digest = self._digests.pop(name, None)
+        self._documents.pop(digest, None)
+        self._aliases.pop(name, None)
+
+    def forget(self, digest):
+        """Remove whichever document has this content, e.g. after its conversion failed."""
+        name = self._documents.get(digest)
+        if name is not None:
+            self.remove(name)
+
+    def clear(self):
+        self.__init__()
+
+    def _unique_name(self, filename):
+        # A different file that reuses a taken name is stored as "name (2).ext"
+        if filename not in self._digests:
+            return filename
+        stem, extension = os.path.splitext(filename)
+        number = 2
+        while f"{stem} ({number}){extension}" in self._digests:
+            number += 1
+        return f"{stem} ({number}){extension}"
@@ -0,0 +1,87 @@
+"""
+Progressive rendering of HTML documents streamed from the model
+"""
+
+import re
+import time
+import threading
+
+# A partial document is only shown once one of these blocks has closed, so
+# what is on screen never ends in the middle of a tag or a list
+BLOCK_END = re.compile(r"</(?:section|header|main|ul|ol|table|div)>", re.IGNORECASE)
+HEAD_END = re.compile(r"</head>", re.IGNORECASE)
+# Only a fence the reply opens with, not one inside the document, e.g. in a <pre>
+OPENING_FENCE = re.compile(r"\s*```[A-Za-z]*[ \t]*\n?")
+
+
+def strip_code_fences(text, final=True):
+    """
+    The HTML inside a ```html fence, or the text itself if there is no fence.
+
+    While streaming (final=False) the closing fence may not have arrived yet,
+    or may have arrived only in part.
+    """
+    opening = OPENING_FENCE.match(text)
+    if opening is None:
+        return text.strip() if final else text
+    body = text[opening.end():]
+    closing = body.find("```")
+    if closing != -1:
+        body = body[:closing]
+    elif not final:
+        body = body.rstrip("`")
+    return body.strip() if final else body
+
+
+class HtmlStream:
+    """
+    Text deltas of one streamed generation, fed from the event loop thread.
+
+    The script thread polls snapshot() for the longest prefix that ends at a
+    closed block, at most once per interval and only when it has grown.
+    """
+
+    def __init__(self, interval=1.5):
+        self.interval = interval
+        self._parts = []
+        self._lock = threading.Lock()
+        self._shown_length = 0
+        self._shown_at = 0.0
+        # (queue position, seconds of rate-limit backoff) while the request waits for its turn
+        self.waiting = None
+
+    def feed(self, delta):
+        with self._lock:
+            self._parts.append(delta)
+
+    def wait(self, position, paused_seconds):
+        self.waiting = (position, paused_seconds)
+
+    @property
+    def text(self):
+        with self._lock:
+            return "".join(self._parts)
+
+    @property
+    def html(self):
+        return strip_code_fences(self.text, final=False)
+
+    def snapshot(self):
+        """A renderable prefix of the document if there is a new one worth showing, else None."""
+        if time.monotonic() - self._shown_at < self.interval:
+            return None
+
+        html = self.html
+        head = HEAD_END.search(html)
+        if head is None:
+            return None
+        end = None
+        for end in BLOCK_END.finditer(html, head.end()):
+            pass
+        if end is None or end.end() <= self._shown_length:
+            return None
+
+        self._shown_length = end.end()
+        self._shown_at = time.monotonic()
+        # Browsers close the tags still open at the end of the document
+        return html[:end.end()]
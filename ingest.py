@@ -0,0 +1,125 @@
+"""
+Streaming conversion of large PDFs, spreadsheets and CSV files
+"""
+
+import os
+import csv
+
+MAX_UPLOAD_MB = float(os.environ.get("INDIEAPP_MAX_UPLOAD_MB", 200))
+# Files of a streaming type above this size are converted part by part
+STREAMING_THRESHOLD_MB = float(os.environ.get("INDIEAPP_STREAMING_THRESHOLD_MB", 10))
+STREAMING_TIMEOUT = float(os.environ.get("INDIEAPP_STREAMING_TIMEOUT", 1800))
+STREAMING_TYPES = ('pdf', 'xlsx', 'csv')
+
+ROWS_PER_PART = 1000
+# Converted markdown is loaded into the session this many characters at a time
+BLOCK_CHARS = 1024 * 1024
+
+
+def extension(filename):
+    return os.path.splitext(filename)[1].lower().lstrip('.')
+
+
+def use_streaming(filename, size):
+    return extension(filename) in STREAMING_TYPES and size > STREAMING_THRESHOLD_MB * 1024 * 1024
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    return str(value).replace("|", "\\|").replace("\r", " ").replace("\n", " ")
+
+
+def _table_row(values):
+    return "| " + " | ".join(_cell(value) for value in values) + " |\n"
+
+
+def markdown_table(rows):
+    """Yield a markdown table of rows: the header row, then the rest in parts of ROWS_PER_PART."""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield _table_row(header) + "| " + " | ".join("---" for _ in header) + " |\n"
+    part = []
+    for row in rows:
+        part.append(_table_row(row))
+        if len(part) >= ROWS_PER_PART:
+            yield "".join(part)
+            part = []
+    if part:
+        yield "".join(part)
+
+
+def pdf_page_text(page):
+    """The text of one page laid out by pdfminer."""
+    from pdfminer.layout import LTTextContainer
+
+    return "".join(element.get_text() for element in page if isinstance(element, LTTextContainer)).strip()
+
+
+def _pdf_parts(path):
+    from pdfminer.high_level import extract_pages
+
+    # extract_pages lays out one page at a time
+    for number, page in enumerate(extract_pages(path), start=1):
+        yield f"<!-- Page number: {number} -->\n{pdf_page_text(page)}\n\n"
+
+
+def _xlsx_parts(path):
+    from openpyxl import load_workbook
+
+    # Read-only mode streams rows from the file instead of loading every cell
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield f"## {sheet.title}\n"
+            yield from markdown_table(sheet.iter_rows(values_only=True))
+            yield "\n"
+    finally:
+        workbook.close()
+
+
+def _csv_parts(path):
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        yield from markdown_table(csv.reader(f))
+
+
+PART_READERS = {
+    'pdf': _pdf_parts,
+    'xlsx': _xlsx_parts,
+    'csv': _csv_parts,
+}
+
+
+def stream_to_file(filename, input_path, output_path):
+    """
+    Convert a file to markdown one page or block of rows at a time, writing it to output_path.
+
+    Runs in a conversion worker process. Returns the number of characters written.
+    """
+    written = 0
+    with open(output_path, "w", encoding="utf-8") as output:
+        for part in PART_READERS[extension(filename)](input_path):
+            output.write(part)
+            written += len(part)
+    return written
+
+
+def read_blocks(path, block_chars=BLOCK_CHARS):
+    """Yield the text of a file in blocks of about block_chars that end on line boundaries."""
+    with open(path, encoding="utf-8") as f:
+        carry = ""
+        while True:
+            data = f.read(block_chars)
+            if not data:
+                break
+            data = carry + data
+            cut = data.rfind("\n") + 1
+            if cut == 0:
+                carry = data
+                continue
+            carry = data[cut:]
+            yield data[:cut]
+        if carry:
+            yield carry
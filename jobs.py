@@ -0,0 +1,223 @@
+"""
+Background conversion jobs that outlive individual script runs
+"""
+
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from conversion import DEFAULT_WORKERS, cache_key, convert_files, convert_to_file, get_cache
+from ingest import use_streaming
+from lazy_pages import lazy_cache_key, use_lazy, scan_document
+import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Each dispatcher thread drives one file through the cache and the process
+# pool, so there are as many threads as conversion processes
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def _get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="conversion-job")
+        return _dispatcher
+
+
+class ConversionJob:
+    """
+    One uploaded file being converted in the background.
+
+    The state moves from queued to running to done or failed. Attributes are
+    written by the job thread and only read by the session's script thread.
+    """
+
+    # Set by the job types that do not produce markdown in memory
+    streaming = False
+    markdown_path = None
+    document = None
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.size = len(data)
+        self.state = QUEUED
+        self.markdown = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._data = data
+
+    @property
+    def pending(self):
+        return self.state in (QUEUED, RUNNING)
+
+    def discard(self):
+        """Release whatever the job holds on disk; nothing for in-memory conversions."""
+
+    def _run(self):
+        self.started_at = time.time()
+        self.state = RUNNING
+        try:
+            converted, errors = convert_files([(self.filename, self._data)])
+            self.markdown = converted.get(self.filename)
+            self.error = errors.get(self.filename)
+        except Exception as e:
+            self.error = str(e) or e.__class__.__name__
+        finally:
+            # The upload bytes are not needed once the conversion has run
+            self._data = None
+            self.finished_at = time.time()
+            self.state = FAILED if self.error is not None else DONE
+
+
+class StreamingConversionJob(ConversionJob):
+    """
+    A large file converted page by page to a markdown file on disk.
+
+    markdown stays None; the session loads markdown_path in blocks once the
+    job is done and then calls discard().
+    """
+
+    streaming = True
+
+    def __init__(self, filename, data):
+        super().__init__(filename, data)
+        self.markdown_path = None
+        self._output_path = None
+        self._discarded = False
+
+    @property
+    def progress_bytes(self):
+        """Bytes of markdown written so far."""
+        try:
+            return os.path.getsize(self._output_path) if self._output_path else 0
+        except OSError:
+            return 0
+
+    def _run(self):
+        self.started_at = time.time()
+        self.state = RUNNING
+        input_path = None
+        try:
+            extension = os.path.splitext(self.filename)[1]
+            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
+                input_path = tmp_file.name
+                tmp_file.write(self._data)
+            self._data = None
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".md") as tmp_file:
+                self._output_path = tmp_file.name
+            convert_to_file(self.filename, input_path, self._output_path)
+            self.markdown_path = self._output_path
+        except Exception as e:
+            self.error = str(e) or e.__class__.__name__
+            self.discard()
+        finally:
+            if self._discarded:
+                # Discarded while converting: nobody will collect the output
+                self.discard()
+            self._data = None
+            if input_path is not None:
+                os.unlink(input_path)
+            self.finished_at = time.time()
+            self.state = FAILED if self.error is not None else DONE
+
+    def discard(self):
+        """Delete the converted markdown file, or have it deleted once the conversion ends."""
+        self._discarded = True
+        path, self._output_path, self.markdown_path = self._output_path, None, None
+        if path is not None:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class LazyConversionJob(StreamingConversionJob):
+    """
+    A large PDF or deck that only has its pages listed up front.
+
+    A file converted before, whole or page by page, is answered from the
+    conversion cache. Otherwise, when it has enough pages, document is a
+    LazyDocument that converts pages as they are needed; shorter files are
+    converted whole like any other upload.
+    """
+
+    streaming = False
+
+    def _run(self):
+        self.started_at = time.time()
+        self.state = RUNNING
+        try:
+            key = cache_key(self.filename, self._data)
+            started = time.perf_counter()
+            # Converted whole before, or every page converted lazily
+            cache = get_cache()
+            markdown = cache.get(key)
+            if markdown is None:
+                markdown = cache.get(lazy_cache_key(key))
+            if markdown is not None:
+                metrics.record(
+                    "conversion",
+                    os.path.splitext(self.filename)[1].lower().lstrip('.'),
+                    time.perf_counter() - started,
+                    input_bytes=self.size,
+                    output_bytes=len(markdown.encode('utf-8')),
+                    cached=True
+                )
+                self.markdown = markdown
+        except Exception as e:
+            self.error = str(e) or e.__class__.__name__
+        if self.markdown is not None or self.error is not None:
+            self._data = None
+            self.finished_at = time.time()
+            self.state = FAILED if self.error is not None else DONE
+            return
+
+        path = None
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(self.filename)[1]) as tmp_file:
+                path = tmp_file.name
+                tmp_file.write(self._data)
+            self.document = scan_document(self.filename, path, key)
+        except Exception:
+            # A file the structure pass cannot read may still convert as a whole
+            self.document = None
+
+        if self.document is None:
+            if path is not None:
+                os.unlink(path)
+            ConversionJob._run(self)
+            return
+
+        self._data = None
+        if self._discarded:
+            self.discard()
+        self.finished_at = time.time()
+        self.state = DONE
+
+    def discard(self):
+        super().discard()
+        if self.document is not None:
+            self.document.discard()
+
+
+def submit_conversion(filename, data):
+    # Files big enough to stream are converted to disk whole, which keeps
+    # memory bounded; lazy conversion is for the ones below that
+    if use_streaming(filename, len(data)):
+        job_class = StreamingConversionJob
+    elif use_lazy(filename, len(data)):
+        job_class = LazyConversionJob
+    else:
+        job_class = ConversionJob
+    job = job_class(filename, data)
+    _get_dispatcher().submit(job._run)
+    return job
@@ -0,0 +1,264 @@
+"""
+Lazy page-by-page conversion of long PDFs and slide decks
+"""
+
+import os
+import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from conversion import DEFAULT_WORKERS, get_cache, run_in_pool
+import metrics
+
+LAZY_TYPES = ('pdf', 'pptx')
+# Shorter or smaller documents are converted whole, as before
+LAZY_MIN_PAGES = int(os.environ.get("INDIEAPP_LAZY_MIN_PAGES", 20))
+LAZY_MIN_MB = float(os.environ.get("INDIEAPP_LAZY_MIN_MB", 1))
+# Pages converted per trip to the process pool when a range is needed
+PAGES_PER_BATCH = 10
+
+_SECTION_PAGE_RE = re.compile(r"^(?:Page|Slide) (\d+)$")
+_SLIDE_MARKER_RE = re.compile(r"<!-- Slide number: \d+ -->")
+
+
+def _kind(filename):
+    return os.path.splitext(filename)[1].lower().lstrip('.')
+
+
+def use_lazy(filename, size):
+    """Whether an upload is large enough to be worth listing its pages before converting any."""
+    return _kind(filename) in LAZY_TYPES and size >= LAZY_MIN_MB * 1024 * 1024
+
+
+def _pdf_titles(path):
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdfdocument import PDFDocument, PDFNoOutlines
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdftypes import resolve1
+
+    with open(path, "rb") as f:
+        document = PDFDocument(PDFParser(f))
+        # Walking the page tree does not parse or lay out any page content
+        page_ids = [page.pageid for page in PDFPage.create_pages(document)]
+        titles = [""] * len(page_ids)
+        numbers = {page_id: number for number, page_id in enumerate(page_ids)}
+
+        # Bookmarks are the only titles a PDF has without reading its text
+        try:
+            for _, title, destination, action, _ in document.get_outlines():
+                if destination is None and action is not None:
+                    destination = resolve1(action).get('D')
+                destination = resolve1(destination)
+                if isinstance(destination, (str, bytes)):
+                    destination = resolve1(document.get_dest(destination))
+                if isinstance(destination, dict):
+                    destination = resolve1(destination.get('D'))
+                if isinstance(destination, list) and destination:
+                    number = numbers.get(getattr(destination[0], 'objid', None))
+                    if number is not None and not titles[number]:
+                        titles[number] = str(title).strip()
+        except PDFNoOutlines:
+            pass
+        except Exception:
+            # Malformed outlines only cost us the titles
+            pass
+    return titles
+
+
+def _pptx_titles(path):
+    from pptx import Presentation
+
+    titles = []
+    for slide in Presentation(path).slides:
+        title = slide.shapes.title
+        titles.append(title.text.strip() if title is not None and title.has_text_frame else "")
+    return titles
+
+
+def scan_pages(filename, path):
+    """The title (or "") of every page or slide. Runs in a conversion worker process."""
+    return _pdf_titles(path) if _kind(filename) == 'pdf' else _pptx_titles(path)
+
+
+def _pdf_pages(path, numbers):
+    from pdfminer.high_level import extract_pages
+    from ingest import pdf_page_text
+
+    # Pages come back in document order, whatever the order asked for
+    numbers = sorted(numbers)
+    pages = extract_pages(path, page_numbers=[number - 1 for number in numbers])
+    return {number: pdf_page_text(page) for number, page in zip(numbers, pages)}
+
+
+def _pptx_pages(path, numbers):
+    import io
+    from pptx import Presentation
+    from markitdown import StreamInfo
+    from conversion import _get_markitdown
+
+    # MarkItDown converts whole decks, so it is given a copy holding only
+    # these slides; the slides dropped from the copy are not written out
+    numbers = sorted(numbers)
+    presentation = Presentation(path)
+    slide_ids = presentation.slides._sldIdLst
+    for number, slide_id in reversed(list(enumerate(slide_ids, start=1))):
+        if number not in numbers:
+            slide_ids.remove(slide_id)
+            presentation.part.drop_rel(slide_id.rId)
+    stream = io.BytesIO()
+    presentation.save(stream)
+    stream.seek(0)
+
+    markdown = _get_markitdown().convert_stream(stream, stream_info=StreamInfo(extension=".pptx")).text_content
+    # The copy's slides are numbered from 1 again
+    slides = _SLIDE_MARKER_RE.split(markdown)[1:]
+    return {number: slide.strip() for number, slide in zip(numbers, slides)}
+
+
+def convert_pages(filename, path, numbers):
+    """Markdown of the given pages (numbered from 1), by number. Runs in a conversion worker process."""
+    if _kind(filename) == 'pdf':
+        return _pdf_pages(path, numbers)
+    return _pptx_pages(path, numbers)
+
+
+def lazy_cache_key(key):
+    """
+    The conversion cache key of a lazily converted document's markdown.
+
+    Its page markers and outline differ from a whole-file conversion, so it
+    is kept apart from the key that convert_files() and the batch CLI read.
+    """
+    return f"{key}:lazy"
+
+
+def section_page(section):
+    """The page number of a retrieval section of a not yet converted page, else None."""
+    match = _SECTION_PAGE_RE.match(section)
+    return int(match.group(1)) if match else None
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class LazyDocument:
+    """
+    A long PDF or deck whose pages are converted the first time they are needed.
+
+    The document starts out as its outline, every page's marker and title,
+    which keeps pages not converted yet findable by retrieval. Converted
+    pages are appended after the outline in the session's DocumentStore and
+    indexed as they arrive, so they count against its memory budget like any
+    other document. The upload stays in a temporary file until every page is
+    converted or the document is discarded. Converted pages are also kept in
+    the conversion cache, so the same file uploaded again does not convert
+    them a second time.
+    """
+
+    def __init__(self, filename, path, titles, cache_key):
+        self.filename = filename
+        self.path = path
+        self.titles = titles
+        self.cache_key = cache_key
+        self.marker = "Page" if _kind(filename) == 'pdf' else "Slide"
+        # Page number: (start, end) of its markdown in the stored document
+        self._pages = {}
+        self._lock = threading.Lock()
+        # Deletes the file if the session goes away without discarding the document
+        self._finalizer = weakref.finalize(self, _unlink, path)
+
+    @property
+    def page_count(self):
+        return len(self.titles)
+
+    @property
+    def converted_count(self):
+        return len(self._pages)
+
+    @property
+    def has_titles(self):
+        return any(self.titles)
+
+    @property
+    def complete(self):
+        return len(self._pages) == len(self.titles)
+
+    def missing(self, numbers=None):
+        numbers = range(1, self.page_count + 1) if numbers is None else numbers
+        return sorted({number for number in numbers if 1 <= number <= self.page_count and number not in self._pages})
+
+    def outline(self):
+        """The document's markdown before any page is converted: every page's marker and title."""
+        return "".join(f"<!-- {self.marker} number: {number} -->\n{title}\n\n" for number, title in enumerate(self.titles, start=1))
+
+    def page(self, documents, number):
+        """The markdown of a converted page, read from the session's DocumentStore."""
+        return documents.read(self.filename, *self._pages[number])
+
+    def materialize(self, documents, index, numbers=None, on_progress=None):
+        """
+        Convert the given pages (all of them by default) that are not converted yet.
+
+        Each page is appended to the document in documents, which must hold
+        the outline, and to the retrieval index as soon as it is converted.
+        Returns the numbers converted by this call. on_progress, if given, is
+        called with the count of converted pages after every batch.
+        """
+        with self._lock:
+            requested = self.missing(numbers)
+            if not requested:
+                return []
+
+            cache = get_cache()
+            for number in requested:
+                markdown = cache.get(f"{self.cache_key}:page{number}")
+                if markdown is not None:
+                    self._store(documents, index, number, markdown)
+            missing = [number for number in requested if number not in self._pages]
+
+            batches = [missing[start:start + PAGES_PER_BATCH] for start in range(0, len(missing), PAGES_PER_BATCH)]
+            # Batches convert in parallel, one per conversion process
+            with ThreadPoolExecutor(max_workers=max(1, min(DEFAULT_WORKERS, len(batches)))) as threads:
+                for pages in threads.map(self._convert_batch, batches):
+                    for number in sorted(pages):
+                        cache.set(f"{self.cache_key}:page{number}", pages[number])
+                        self._store(documents, index, number, pages[number])
+                    if on_progress:
+                        on_progress(len(self._pages))
+            if self.complete:
+                # Nothing is left to read from the upload, and the same file uploaded
+                # again is answered whole from the conversion cache
+                self._finalizer()
+                cache.set(lazy_cache_key(self.cache_key), "".join(documents.parts(self.filename)))
+            return requested
+
+    def _store(self, documents, index, number, markdown):
+        header = f"<!-- {self.marker} number: {number} -->\n"
+        part = f"{header}{markdown}\n\n"
+        offset = documents.size(self.filename)[0]
+        documents.append(self.filename, part)
+        index.extend_document(self.filename, part, offset)
+        start = offset + len(header)
+        self._pages[number] = (start, start + len(markdown))
+
+    def _convert_batch(self, numbers):
+        with metrics.timed("conversion", f"{_kind(self.filename)} pages", pages=len(numbers)) as values:
+            pages = run_in_pool(convert_pages, self.filename, self.path, numbers)
+            values['output_bytes'] = sum(len(markdown.encode('utf-8')) for markdown in pages.values())
+        return pages
+
+    def discard(self):
+        self._finalizer()
+
+
+def scan_document(filename, path, cache_key):
+    """A LazyDocument over the file at path, or None if it is too short to be worth it."""
+    with metrics.timed("conversion", f"{_kind(filename)} scan", input_bytes=os.path.getsize(path)):
+        titles = run_in_pool(scan_pages, filename, path)
+    if len(titles) < LAZY_MIN_PAGES:
+        return None
+    return LazyDocument(filename, path, titles, cache_key)
@@ -0,0 +1,382 @@
+"""
+Helpers for calling Azure OpenAI chat completions
+"""
+
+import os
+import json
+import asyncio
+import time
+import hashlib
+import threading
+from disk_cache import DiskCache
+from prompts import PROMPT_VERSION
+from rate_limit import POLL_INTERVAL, get_scheduler, estimate_tokens, retry_delay, is_rate_limited
+import metrics
+
+RESPONSE_CACHE_MB = float(os.environ.get("INDIEAPP_RESPONSE_CACHE_MB", 256))
+RESPONSE_CACHE_TTL_HOURS = float(os.environ.get("INDIEAPP_RESPONSE_CACHE_TTL_HOURS", 24 * 7))
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+# Async clients bind their connections to one event loop, so every async
+# call in the process runs on this shared loop in a background thread
+_loop = None
+_loop_lock = threading.Lock()
+
+# Streamed responses only report usage when asked to, which needs this API version
+STREAM_USAGE_API_VERSION = "2024-09-01"
+
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+class ChatStream:
+    """
+    Iterate over a streamed chat completion as text deltas.
+
+    Timings are measured from the moment the request is sent:
+    time_to_first_token once the first content arrives and total_latency
+    once the stream is exhausted or closed early. With a call_site, the call
+    is recorded in the metrics when it ends.
+    """
+
+    def __init__(self, client, call_site=None, session=None, on_wait=None, check=None, **kwargs):
+        self._call_site = call_site
+        self._messages = kwargs.get('messages', [])
+        self._parts = []
+        self._error = None
+        self.time_to_first_token = None
+        self.total_latency = None
+        self.finished = False
+        self.usage = None
+        self._started = time.perf_counter()
+        try:
+            self._response, waited = create(client, call_site, session, on_wait, check=check, stream=True, **kwargs)
+        except Exception as e:
+            if call_site is not None:
+                record_call(call_site, time.perf_counter() - self._started, error=e.__class__.__name__, messages=self._messages)
+            raise
+        # Time spent queued for the rate limit is not the model's latency
+        self._started += waited
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def __iter__(self):
+        try:
+            for chunk in self._response:
+                # With include_usage the last chunk carries the usage and no choices
+                if getattr(chunk, 'usage', None) is not None:
+                    self.usage = chunk.usage
+                # Azure sends prompt filter results as chunks without choices
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - self._started
+                self._parts.append(delta)
+                yield delta
+        except Exception as e:
+            self._error = e.__class__.__name__
+            raise
+
+        self.finished = True
+        self.close()
+
+    def close(self):
+        """Stop the request, releasing the connection if it is still streaming."""
+        if self.total_latency is None:
+            self.total_latency = time.perf_counter() - self._started
+            self._response.close()
+            if self._call_site is not None:
+                record_call(
+                    self._call_site,
+                    self.total_latency,
+                    usage=self.usage,
+                    error=self._error,
+                    messages=self._messages,
+                    text=self.text,
+                    # Prompt caching shows up as a shorter wait for the first token
+                    usage_latency=self.time_to_first_token,
+                    time_to_first_token=self.time_to_first_token,
+                    stopped=not self.finished and self._error is None
+                )
+
+
+def get_response_cache():
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = DiskCache(
+                "responses",
+                max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024),
+                ttl=RESPONSE_CACHE_TTL_HOURS * 3600
+            )
+        return _response_cache
+
+
+def response_cache_key(client, **kwargs):
+    # kwargs holds the deployment, the messages and every sampling parameter
+    request = {
+        'endpoint': str(client.base_url),
+        'prompt_version': PROMPT_VERSION,
+        'request': kwargs,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def stream_options(api_version):
+    """Extra arguments for ChatStream so the response reports its token usage, when the API supports it."""
+    if api_version and api_version >= STREAM_USAGE_API_VERSION:
+        return {'stream_options': {'include_usage': True}}
+    return {}
+
+
+def record_usage(call_site, usage, latency):
+    """Add one response's token usage, including prompt-cache hits, to the per-call-site totals."""
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) or 0
+
+    with _usage_lock:
+        stats = _usage.setdefault(call_site, {
+            'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0,
+            'cached_calls': 0, 'cached_latency': 0.0, 'uncached_latency': 0.0,
+        })
+        stats['calls'] += 1
+        stats['prompt_tokens'] += usage.prompt_tokens or 0
+        stats['completion_tokens'] += usage.completion_tokens or 0
+        stats['cached_tokens'] += cached_tokens
+        if cached_tokens:
+            stats['cached_calls'] += 1
+            stats['cached_latency'] += latency
+        else:
+            stats['uncached_latency'] += latency
+
+
+def record_call(call_site, duration, usage=None, error=None, messages=(), text="", usage_latency=None, **values):
+    """Record one model call in the metrics, and its token usage in the prompt-cache totals."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    metrics.record(
+        "llm",
+        call_site,
+        duration,
+        error=error,
+        input_tokens=getattr(usage, 'prompt_tokens', None),
+        output_tokens=getattr(usage, 'completion_tokens', None),
+        cached_tokens=getattr(details, 'cached_tokens', None),
+        input_bytes=len(json.dumps(messages, default=str).encode('utf-8')),
+        output_bytes=len((text or "").encode('utf-8')),
+        **values
+    )
+    if error is None:
+        record_usage(call_site, usage, usage_latency or duration)
+
+
+def usage_stats():
+    """Per call site: token totals, the share of prompt tokens served from the prompt cache and mean latencies."""
+    with _usage_lock:
+        usage = {site: dict(stats) for site, stats in _usage.items()}
+
+    for stats in usage.values():
+        uncached_calls = stats['calls'] - stats['cached_calls']
+        stats['cached_share'] = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        stats['cached_latency'] = stats['cached_latency'] / stats['cached_calls'] if stats['cached_calls'] else None
+        stats['uncached_latency'] = stats['uncached_latency'] / uncached_calls if uncached_calls else None
+    return usage
+
+
+def _record_queue(call_site, waited, retries, error=None):
+    if call_site is not None:
+        metrics.record("queue", call_site, waited, error=error, retries=retries)
+
+
+def _sleep(seconds, check):
+    # Wakes up every poll interval so check() can abandon the wait
+    deadline = time.monotonic() + seconds
+    while True:
+        if check is not None:
+            check()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(POLL_INTERVAL, remaining))
+
+
+def create(client, call_site, session=None, on_wait=None, check=None, **kwargs):
+    """
+    client.chat.completions.create(**kwargs) on a sync client, admitted by the process-wide rate limiter.
+
+    Waits for a turn in the queue, then retries rate-limited and transient
+    failures with backoff. Returns (response, seconds spent waiting).
+    on_wait(position, paused_seconds) is called while queued, and check()
+    on every poll of the queue and the backoff, so it can stop the wait.
+    """
+    scheduler = get_scheduler()
+    cost = estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+    waited = 0.0
+    sequence = None
+    attempt = 1
+    while True:
+        started = time.perf_counter()
+        ticket = scheduler.acquire(call_site, cost, session, on_wait, sequence, check)
+        sequence = ticket.sequence
+        waited += time.perf_counter() - started
+        try:
+            response = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt, call_site)
+            if delay is None:
+                _record_queue(call_site, waited, attempt - 1, error=e.__class__.__name__)
+                raise
+            started = time.perf_counter()
+            if is_rate_limited(e):
+                # The quota is shared, so everyone holds off, and this request keeps its place in line
+                scheduler.backoff(delay)
+            else:
+                _sleep(delay, check)
+            waited += time.perf_counter() - started
+            attempt += 1
+            continue
+        _record_queue(call_site, waited, attempt - 1)
+        return response, waited
+
+
+async def acreate(client, call_site, session=None, on_wait=None, **kwargs):
+    """create() for an async client, on the shared event loop."""
+    scheduler = get_scheduler()
+    cost = estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+    waited = 0.0
+    sequence = None
+    attempt = 1
+    while True:
+        started = time.perf_counter()
+        ticket = await scheduler.acquire_async(call_site, cost, session, on_wait, sequence)
+        sequence = ticket.sequence
+        waited += time.perf_counter() - started
+        try:
+            response = await client.chat.completions.create(**kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt, call_site)
+            if delay is None:
+                _record_queue(call_site, waited, attempt - 1, error=e.__class__.__name__)
+                raise
+            started = time.perf_counter()
+            if is_rate_limited(e):
+                scheduler.backoff(delay)
+            else:
+                await asyncio.sleep(delay)
+            waited += time.perf_counter() - started
+            attempt += 1
+            continue
+        _record_queue(call_site, waited, attempt - 1)
+        return response, waited
+
+
+def completion(client, call_site, session=None, **kwargs):
+    """A plain, non-streamed chat completion on a sync client, recorded in the metrics under call_site."""
+    started = time.perf_counter()
+    try:
+        response, waited = create(client, call_site, session, **kwargs)
+    except Exception as e:
+        record_call(call_site, time.perf_counter() - started, error=e.__class__.__name__, messages=kwargs.get('messages', []))
+        raise
+    record_call(
+        call_site,
+        time.perf_counter() - started - waited,
+        usage=getattr(response, 'usage', None),
+        messages=kwargs.get('messages', []),
+        text=response.choices[0].message.content if response.choices else ""
+    )
+    return response
+
+
+async def _stream_text(client, call_site, session, on_wait, on_delta, **kwargs):
+    stream, waited = await acreate(client, call_site, session, on_wait, stream=True, **kwargs)
+    parts = []
+    finish_reason = None
+    usage = None
+    try:
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                on_delta(choice.delta.content)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    finally:
+        # Also runs when the task is cancelled, which drops the connection
+        await stream.close()
+    return "".join(parts), finish_reason, usage, waited
+
+
+async def cached_completion(client, regenerate=False, call_site=None, on_delta=None, session=None, on_wait=None, **kwargs):
+    """
+    Return (text, from_cache) for a chat completion, reusing a stored answer when possible.
+
+    client is an async client. regenerate=True always calls the model and
+    replaces the stored answer. Answers cut off by max_tokens are not stored.
+    With on_delta, the answer is streamed and on_delta(text) is called on the
+    event loop thread for every delta; cancelling the task stops the stream.
+    Model calls are recorded in the metrics under call_site. Requests wait
+    for their turn in the rate limiter's queue; on_wait(position,
+    paused_seconds) is called on the event loop thread while they do.
+    """
+    cache = get_response_cache()
+    # Whether the answer is streamed does not change it
+    key = response_cache_key(client, **{name: value for name, value in kwargs.items() if name != 'stream_options'})
+
+    if not regenerate:
+        text = cache.get(key)
+        if text is not None:
+            return text, True
+
+    messages = kwargs.get('messages', [])
+    started = time.perf_counter()
+    try:
+        if on_delta is None:
+            response, waited = await acreate(client, call_site, session, on_wait, **kwargs)
+            usage = getattr(response, 'usage', None)
+            text, finish_reason = response.choices[0].message.content, response.choices[0].finish_reason
+        else:
+            text, finish_reason, usage, waited = await _stream_text(client, call_site, session, on_wait, on_delta, **kwargs)
+    except asyncio.CancelledError:
+        # Stopped by the user rather than failed
+        if call_site is not None:
+            record_call(call_site, time.perf_counter() - started, messages=messages, stopped=True)
+        raise
+    except Exception as e:
+        if call_site is not None:
+            record_call(call_site, time.perf_counter() - started, error=e.__class__.__name__, messages=messages)
+        raise
+
+    if call_site is not None:
+        record_call(call_site, time.perf_counter() - started - waited, usage=usage, messages=messages, text=text,
+                    finish_reason=finish_reason)
+    if text and finish_reason == "stop":
+        cache.set(key, text)
+    return text, False
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+
+def run_async(coro):
+    """Schedule a coroutine on the shared event loop and return a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
@@ -0,0 +1,176 @@
+"""
+Process-wide timings and sizes of conversions, context builds and model calls
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Recent events kept per (kind, name) for percentiles
+WINDOW_EVENTS = 1000
+# Throughput is measured over this many seconds
+THROUGHPUT_WINDOW = 300
+# Opt-in exports: every event appended as a JSON line, and a Prometheus text
+# file rewritten at most every PROMETHEUS_INTERVAL seconds
+METRICS_FILE = os.environ.get("INDIEAPP_METRICS_FILE")
+PROMETHEUS_FILE = os.environ.get("INDIEAPP_METRICS_PROMETHEUS_FILE")
+PROMETHEUS_INTERVAL = 10
+
+# Values summed and averaged per series, when events report them
+VALUE_FIELDS = ['input_tokens', 'output_tokens', 'cached_tokens', 'input_bytes', 'output_bytes', 'retries']
+
+_lock = threading.Lock()
+_series = {}
+_prometheus_written = 0.0
+
+
+class _Series:
+    __slots__ = ('events', 'count', 'errors', 'duration', 'totals')
+
+    def __init__(self):
+        self.events = deque(maxlen=WINDOW_EVENTS)
+        self.count = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.totals = dict.fromkeys(VALUE_FIELDS, 0)
+
+
+def record(kind, name, duration, error=None, **values):
+    """
+    Record one finished operation.
+
+    kind is "conversion", "context", "llm", "queue" or "startup"; name is
+    the file type, call site or startup step. error is the exception class name of a
+    failed operation. Extra values (token counts, payload sizes, flags) are
+    kept with the event.
+    """
+    global _prometheus_written
+    event = {'time': time.time(), 'kind': kind, 'name': name, 'duration': duration, 'error': error}
+    event.update(values)
+
+    with _lock:
+        series = _series.get((kind, name))
+        if series is None:
+            series = _series[(kind, name)] = _Series()
+        series.events.append(event)
+        series.count += 1
+        series.duration += duration
+        if error is not None:
+            series.errors += 1
+        for field in VALUE_FIELDS:
+            series.totals[field] += values.get(field) or 0
+
+        export_prometheus = PROMETHEUS_FILE and event['time'] - _prometheus_written >= PROMETHEUS_INTERVAL
+        if export_prometheus:
+            _prometheus_written = event['time']
+
+    try:
+        if METRICS_FILE:
+            with open(METRICS_FILE, "a") as f:
+                f.write(json.dumps(event, default=str) + "\n")
+        if export_prometheus:
+            write_prometheus(PROMETHEUS_FILE)
+    except OSError:
+        # Exporting is best effort; the in-process metrics are still recorded
+        pass
+
+
+@contextmanager
+def timed(kind, name, **values):
+    """
+    Record the duration of the with-block, and the exception class if it raises.
+
+    The block can add values to the yielded dict, e.g. token counts known only at the end.
+    """
+    values = dict(values)
+    started = time.perf_counter()
+    try:
+        yield values
+    except BaseException as e:
+        record(kind, name, time.perf_counter() - started, error=e.__class__.__name__, **values)
+        raise
+    record(kind, name, time.perf_counter() - started, **values)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summary():
+    """One row per (kind, name): counts, latency percentiles over recent events, throughput and average sizes."""
+    now = time.time()
+    with _lock:
+        snapshot = [(kind, name, list(series.events), series.count, series.errors, series.duration, dict(series.totals))
+                    for (kind, name), series in _series.items()]
+
+    rows = []
+    for kind, name, events, count, errors, duration, totals in sorted(snapshot, key=lambda item: item[:2]):
+        durations = sorted(event['duration'] for event in events)
+        recent = sum(1 for event in events if now - event['time'] <= THROUGHPUT_WINDOW)
+        row = {
+            'kind': kind,
+            'name': name,
+            'count': count,
+            'errors': errors,
+            'p50': _percentile(durations, 0.5),
+            'p95': _percentile(durations, 0.95),
+            'mean': duration / count,
+            'total_seconds': duration,
+            'per_minute': recent * 60 / THROUGHPUT_WINDOW,
+        }
+        for field in VALUE_FIELDS:
+            row[f"avg_{field}"] = totals[field] / count
+        rows.append(row)
+    return rows
+
+
+def recent_errors(limit=20):
+    with _lock:
+        events = [event for series in _series.values() for event in series.events if event['error']]
+    return sorted(events, key=lambda event: event['time'], reverse=True)[:limit]
+
+
+def prometheus_text():
+    """The summary in the Prometheus text exposition format."""
+    lines = [
+        "# HELP indieapp_operations_total Operations recorded since the process started.",
+        "# TYPE indieapp_operations_total counter",
+    ]
+    rows = summary()
+    for row in rows:
+        labels = f'kind="{row["kind"]}",name="{row["name"]}"'
+        lines.append(f"indieapp_operations_total{{{labels}}} {row['count']}")
+    lines += ["# HELP indieapp_errors_total Failed operations.", "# TYPE indieapp_errors_total counter"]
+    for row in rows:
+        labels = f'kind="{row["kind"]}",name="{row["name"]}"'
+        lines.append(f"indieapp_errors_total{{{labels}}} {row['errors']}")
+    # Quantiles cover the recent events, _sum and _count every operation since the process started
+    lines += ["# HELP indieapp_duration_seconds Duration of operations.", "# TYPE indieapp_duration_seconds summary"]
+    for row in rows:
+        labels = f'kind="{row["kind"]}",name="{row["name"]}"'
+        for quantile in ['p50', 'p95']:
+            if row[quantile] is not None:
+                lines.append(f'indieapp_duration_seconds{{{labels},quantile="0.{quantile[1:]}"}} {row[quantile]:.6f}')
+        lines.append(f"indieapp_duration_seconds_sum{{{labels}}} {row['total_seconds']:.6f}")
+        lines.append(f"indieapp_duration_seconds_count{{{labels}}} {row['count']}")
+    lines += ["# HELP indieapp_tokens_total Tokens sent to and received from the model.", "# TYPE indieapp_tokens_total counter"]
+    with _lock:
+        totals = [(kind, name, dict(series.totals)) for (kind, name), series in _series.items() if kind == "llm"]
+    for kind, name, values in totals:
+        for field in ['input_tokens', 'output_tokens', 'cached_tokens']:
+            lines.append(f'indieapp_tokens_total{{name="{name}",type="{field[:-len("_tokens")]}"}} {values[field]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    # Write then rename, so a scraper never reads a half-written file
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write(prometheus_text())
+    os.replace(temporary, path)
@@ -0,0 +1,101 @@
+"""
+Paginated, cached rendering for the File Upload preview
+"""
+
+import html
+from collections import OrderedDict
+
+PREVIEW_PAGE_CHARS = 20000
+FILES_PER_PAGE = 10
+
+# Rendered pages kept per session; only a handful are ever on screen at once
+MAX_CACHED_PAGES = 32
+
+FILE_TYPE_CONFIG = {
+    'PDF': {'icon': '📕', 'color': '#dc3545', 'bg_color': '#f8d7da'},
+    'DOC': {'icon': '📘', 'color': '#0d6efd', 'bg_color': '#cce7ff'},
+    'DOCX': {'icon': '📘', 'color': '#0d6efd', 'bg_color': '#cce7ff'},
+    'TXT': {'icon': '📝', 'color': '#6c757d', 'bg_color': '#e9ecef'},
+    'MD': {'icon': '📝', 'color': '#6c757d', 'bg_color': '#e9ecef'},
+    'XLSX': {'icon': '📊', 'color': '#198754', 'bg_color': '#d1eddb'},
+    'XLS': {'icon': '📊', 'color': '#198754', 'bg_color': '#d1eddb'},
+    'CSV': {'icon': '📊', 'color': '#198754', 'bg_color': '#d1eddb'},
+    'PPTX': {'icon': '📈', 'color': '#fd7e14', 'bg_color': '#ffe5cc'},
+    'PPT': {'icon': '📈', 'color': '#fd7e14', 'bg_color': '#ffe5cc'},
+    'HTML': {'icon': '🌐', 'color': '#6610f2', 'bg_color': '#e0cffc'},
+    'HTM': {'icon': '🌐', 'color': '#6610f2', 'bg_color': '#e0cffc'},
+}
+DEFAULT_FILE_TYPE = {'icon': '📄', 'color': '#6c757d', 'bg_color': '#e9ecef'}
+
+
+def file_type(filename):
+    file_ext = filename.split('.')[-1].upper() if '.' in filename else 'FILE'
+    return file_ext, FILE_TYPE_CONFIG.get(file_ext, DEFAULT_FILE_TYPE)
+
+
+def _page_offsets(parts, page_chars):
+    # Break pages at line boundaries so rows and paragraphs are not split.
+    # The text arrives in parts, and only the unpaginated rest is held
+    offsets = [0]
+    rest = ""
+    for part in parts:
+        rest += part
+        while len(rest) > page_chars:
+            newline = rest.rfind('\n', 0, page_chars)
+            cut = newline + 1 if newline > 0 else page_chars
+            offsets.append(offsets[-1] + cut)
+            rest = rest[cut:]
+    return offsets
+
+
+class PreviewCache:
+    """
+    Size stats and escaped HTML pages per file, computed once and reused across reruns.
+
+    Documents are only read from the DocumentStore on a cache miss, a part
+    or a page at a time, and entries must be invalidated whenever a file's
+    content changes.
+    """
+
+    def __init__(self, page_chars=PREVIEW_PAGE_CHARS):
+        self.page_chars = page_chars
+        self._stats = {}
+        self._pages = OrderedDict()
+
+    def invalidate(self, filename=None):
+        if filename is None:
+            self._stats.clear()
+            self._pages.clear()
+            return
+        self._stats.pop(filename, None)
+        for key in [key for key in self._pages if key[0] == filename]:
+            del self._pages[key]
+
+    def stats(self, filename, documents):
+        stats = self._stats.get(filename)
+        if stats is None:
+            chars, nbytes = documents.size(filename)
+            stats = {
+                'chars': chars,
+                'kb': round(nbytes / 1024, 1),
+                'offsets': _page_offsets(documents.parts(filename), self.page_chars),
+            }
+            self._stats[filename] = stats
+        return stats
+
+    def page(self, filename, documents, number):
+        """The escaped HTML of one page (numbered from 1) of a file's markdown."""
+        key = (filename, number)
+        fragment = self._pages.get(key)
+        if fragment is None:
+            offsets = self.stats(filename, documents)['offsets']
+            start = offsets[number - 1]
+            end = offsets[number] if number < len(offsets) else None
+            fragment = html.escape(documents.read(filename, start, end))
+
+            self._pages[key] = fragment
+            if len(self._pages) > MAX_CACHED_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(key)
+        return fragment
@@ -2,13 +2,16 @@
 Prompts for AI generation features
 """
 
+# Bump whenever a prompt changes so cached responses to the old wording are not reused
+PROMPT_VERSION = 2
+
+# The uploaded context goes at the very end of each prompt: everything before
+# it is identical from call to call, so the provider can reuse its cached prefix
+
 def get_business_canvas_prompt(context):
     return f"""
 Act as an expert business strategist and senior frontend developer. Your task is to create a complete, visually clean, and well-structured HTML Business Model Canvas based on the provided context. The final output must be a single, self-contained HTML file.
 
-**CONTEXT FROM UPLOADED FILES:**
-{context if context else "No context files were provided."}
-
 **--- CORE TASK & INSTRUCTIONS ---**
 
 **1. Analyze and Populate:**
@@ -181,6 +184,9 @@ You must use this template as the foundation for your response. Populate the `<u
 </body>
 </html>
 ```
+
+**CONTEXT FROM UPLOADED FILES:**
+{context if context else "No context files were provided."}
 """
 
 
@@ -188,9 +194,6 @@ def get_value_proposition_prompt(context):
     return f"""
 Act as an expert product manager and senior frontend developer. Your specialty is translating complex business frameworks into clear, intuitive, and visually appealing web interfaces. Your task is to create a complete HTML Value Proposition Canvas based on the provided context.
 
-**CONTEXT FROM UPLOADED FILES:**
-{context if context else "No context files were provided."}
-
 **--- CORE TASK & INSTRUCTIONS ---**
 
 **1. Analyze and Populate:**
@@ -316,4 +319,7 @@ You must use this template as the foundation for your response. Populate the `<u
 ```
 
 Return ONLY the complete HTML code, no markdown formatting.
+
+**CONTEXT FROM UPLOADED FILES:**
+{context if context else "No context files were provided."}
 """
\ No newline at end of file
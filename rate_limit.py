@@ -0,0 +1,273 @@
+"""
+Process-wide rate limiting, fair queuing and retries for Azure OpenAI requests
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+import itertools
+from email.utils import parsedate_to_datetime
+from context import count_tokens
+
+# The deployment's quota; 0 leaves that dimension unlimited, so requests
+# only queue while the endpoint has asked us to back off
+REQUESTS_PER_MINUTE = float(os.environ.get("INDIEAPP_RATE_LIMIT_RPM", 0))
+TOKENS_PER_MINUTE = float(os.environ.get("INDIEAPP_RATE_LIMIT_TPM", 0))
+MAX_ATTEMPTS = int(os.environ.get("INDIEAPP_RATE_LIMIT_ATTEMPTS", 5))
+MAX_BACKOFF = 60.0
+POLL_INTERVAL = 0.1
+
+# Lower goes first: someone waiting on a chat answer goes ahead of background
+# summaries, which go ahead of 6000-token canvas generations
+PRIORITIES = {
+    'chat': 0,
+    'connection_test': 0,
+    'chat_summary': 1,
+    'business_plan': 2,
+    'value_proposition': 2,
+}
+DEFAULT_PRIORITY = 1
+# Call sites that fail fast instead of retrying: a connection test against a
+# wrong endpoint should say so, not spend a minute backing off
+MAX_ATTEMPTS_BY_CALL_SITE = {
+    'connection_test': 1,
+}
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+
+def estimate_tokens(messages, max_tokens):
+    """A request's cost against the TPM quota: prompt tokens plus max_tokens, as Azure counts it."""
+    prompt = sum(count_tokens(message.get('content') or "") for message in messages)
+    return prompt + (max_tokens or 0)
+
+
+class TokenBucket:
+    """Up to per_minute units, refilled continuously. per_minute=0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, cost, now):
+        """Seconds until cost units are available. Costs above the capacity wait for a full bucket."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        missing = min(cost, self.per_minute) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, cost, now):
+        if self.per_minute:
+            self._refill(now)
+            self.level -= min(cost, self.per_minute)
+
+
+class Ticket:
+    __slots__ = ('call_site', 'session', 'cost', 'sequence', 'key', 'granted', 'enqueued_at')
+
+
+class Scheduler:
+    """
+    Admits model requests in priority order within the RPM and TPM budgets.
+
+    Within a priority, sessions take turns: a session's n-th queued request
+    waits behind every other session's earlier turns. Waiters poll rather
+    than block on a thread, so the same queue serves the script threads
+    and the shared event loop. A 429 pauses admission for everyone, since
+    the quota is shared by the whole process.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self._lock = threading.Lock()
+        self._queue = []
+        self._queued_per_session = {}
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None):
+        with self._lock:
+            if requests_per_minute is not None:
+                self._requests = TokenBucket(requests_per_minute)
+            if tokens_per_minute is not None:
+                self._tokens = TokenBucket(tokens_per_minute)
+
+    def _enqueue(self, call_site, cost, session, sequence):
+        ticket = Ticket()
+        ticket.call_site, ticket.session, ticket.cost = call_site, session, cost
+        ticket.granted = False
+        ticket.enqueued_at = time.monotonic()
+        with self._lock:
+            turn = self._queued_per_session.get(session, 0)
+            self._queued_per_session[session] = turn + 1
+            # A retried request keeps its original place in line
+            ticket.sequence = next(self._sequence) if sequence is None else sequence
+            ticket.key = (PRIORITIES.get(call_site, DEFAULT_PRIORITY), turn, ticket.sequence)
+            self._queue.append(ticket)
+            self._queue.sort(key=lambda queued: queued.key)
+        return ticket
+
+    def _leave(self, ticket):
+        # Called with the lock held
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+        remaining = self._queued_per_session.get(ticket.session, 1) - 1
+        if remaining:
+            self._queued_per_session[ticket.session] = remaining
+        else:
+            self._queued_per_session.pop(ticket.session, None)
+
+    def _dispatch(self):
+        """Admit requests from the head of the queue while the budgets allow. Returns seconds until the next try."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            while self._queue:
+                head = self._queue[0]
+                # Strictly in order, so a large request is not starved by a stream of small ones
+                wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(head.cost, now))
+                if wait > 0:
+                    return wait
+                self._requests.take(1, now)
+                self._tokens.take(head.cost, now)
+                head.granted = True
+                self._leave(head)
+            return 0.0
+
+    def position(self, ticket):
+        """1 for the next request to be admitted, 0 once admitted."""
+        with self._lock:
+            return 0 if ticket.granted else self._queue.index(ticket) + 1
+
+    def paused_for(self):
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def backoff(self, seconds):
+        """Admit nothing for the next seconds, e.g. after a 429."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _report(self, ticket, on_wait, last):
+        if on_wait is None:
+            return last
+        state = (self.position(ticket), round(self.paused_for()))
+        if state != last and state[0]:
+            on_wait(*state)
+        return state
+
+    def acquire(self, call_site, cost, session=None, on_wait=None, sequence=None, check=None):
+        """
+        Wait on this thread until the request may be sent; returns its ticket.
+
+        on_wait(position, paused_seconds) is called on this thread whenever
+        the queue position or the backoff changes while waiting. check(), if
+        given, is called on every poll; whatever it raises abandons the wait.
+        """
+        ticket = self._enqueue(call_site, cost, session, sequence)
+        last = None
+        try:
+            while True:
+                delay = self._dispatch()
+                if ticket.granted:
+                    return ticket
+                if check is not None:
+                    check()
+                last = self._report(ticket, on_wait, last)
+                time.sleep(min(POLL_INTERVAL, delay) or POLL_INTERVAL)
+        finally:
+            # Interrupted while waiting: give up the place in line
+            if not ticket.granted:
+                with self._lock:
+                    self._leave(ticket)
+
+    async def acquire_async(self, call_site, cost, session=None, on_wait=None, sequence=None):
+        """acquire() for coroutines; on_wait is called on the event loop thread."""
+        ticket = self._enqueue(call_site, cost, session, sequence)
+        last = None
+        try:
+            while True:
+                delay = self._dispatch()
+                if ticket.granted:
+                    return ticket
+                last = self._report(ticket, on_wait, last)
+                await asyncio.sleep(min(POLL_INTERVAL, delay) or POLL_INTERVAL)
+        finally:
+            if not ticket.granted:
+                with self._lock:
+                    self._leave(ticket)
+
+    def status(self):
+        with self._lock:
+            queued = {}
+            for ticket in self._queue:
+                queued[ticket.call_site] = queued.get(ticket.call_site, 0) + 1
+            oldest = min((ticket.enqueued_at for ticket in self._queue), default=None)
+            return {
+                'requests_per_minute': self._requests.per_minute,
+                'tokens_per_minute': self._tokens.per_minute,
+                'queued': len(self._queue),
+                'queued_by_call_site': queued,
+                'oldest_wait': time.monotonic() - oldest if oldest is not None else 0.0,
+                'paused_for': max(0.0, self._paused_until - time.monotonic()),
+            }
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def retry_delay(error, attempt, call_site=None):
+    """
+    Seconds to wait before trying again after error on the given attempt (from 1), or None if it should not be retried.
+
+    The endpoint's retry-after wins; otherwise the wait grows exponentially, with jitter.
+    """
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        retryable = True
+    elif isinstance(error, openai.APIStatusError):
+        retryable = error.status_code in RETRYABLE_STATUS
+    else:
+        retryable = False
+    if not retryable or attempt >= MAX_ATTEMPTS_BY_CALL_SITE.get(call_site, MAX_ATTEMPTS):
+        return None
+
+    delay = _retry_after(error)
+    if delay is None:
+        delay = min(MAX_BACKOFF, 2 ** (attempt - 1)) * random.uniform(0.75, 1.25)
+    return min(MAX_BACKOFF, delay)
+
+
+def is_rate_limited(error):
+    return getattr(error, 'status_code', None) == 429
+
+
+_scheduler = Scheduler()
+
+
+def get_scheduler():
+    return _scheduler
@@ -0,0 +1,209 @@
+"""
+Chunking and BM25 retrieval over converted documents
+"""
+
+import re
+import math
+from collections import Counter
+
+MAX_CHUNK_CHARS = 1500
+DEFAULT_TOP_K = 8
+
+_TOKEN_RE = re.compile(r"\w+")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+_MARKER_RE = re.compile(r"^<!--\s*(Slide|Page) number:\s*(\d+)\s*-->$")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its of on or
+our so that the their there these they this to was we what when where which who why
+will with you your
+""".split())
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def _chunk_spans(text, max_chars, title=None):
+    """(title, start, end) spans of text, and the (title, start) of the chunk still open at its end."""
+    spans = []
+    chunk_start = 0
+    position = 0
+
+    def close(end):
+        if text[chunk_start:end].strip():
+            spans.append((title, chunk_start, end))
+
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        heading = _HEADING_RE.match(stripped)
+        marker = _MARKER_RE.match(stripped)
+        line_end = position + len(line)
+
+        if heading or marker:
+            close(position)
+            title = heading.group(2).strip() if heading else f"{marker.group(1)} {marker.group(2)}"
+            chunk_start = position if heading else line_end
+        else:
+            # Long sections are split on line boundaries so tables stay readable
+            if position > chunk_start and line_end - chunk_start > max_chars:
+                close(position)
+                chunk_start = position
+            while line_end - chunk_start > max_chars:
+                close(chunk_start + max_chars)
+                chunk_start += max_chars
+        position = line_end
+    close(position)
+    return spans, (title, chunk_start)
+
+
+def chunk_markdown(text, max_chars=MAX_CHUNK_CHARS):
+    """
+    Split markdown into (section, start, end) chunks along headings and slide or page markers.
+
+    Chunks are character spans of text, so callers can keep the spans and
+    slice the document again later instead of holding on to copies.
+    """
+    spans, _ = _chunk_spans(text, max_chars)
+    return [
+        (title or f"Part {number}", start, end)
+        for number, (title, start, end) in enumerate(spans, start=1)
+    ]
+
+
+class Chunk:
+    __slots__ = ('filename', 'section', 'start', 'end', 'terms', 'length')
+
+    def __init__(self, filename, section, start, end, term_counts):
+        self.filename = filename
+        self.section = section
+        self.start = start
+        self.end = end
+        self.terms = tuple(term_counts)
+        self.length = sum(term_counts.values())
+
+
+class Excerpt:
+    """A retrieved chunk together with its text."""
+
+    __slots__ = ('filename', 'section', 'text')
+
+    def __init__(self, filename, section, text):
+        self.filename = filename
+        self.section = section
+        self.text = text
+
+
+class RetrievalIndex:
+    """
+    An in-memory BM25 index that is updated one document at a time.
+
+    Adding or removing a file only touches that file's own chunks and
+    postings, so the cost does not grow with the rest of the corpus. The
+    index keeps only spans and term statistics; excerpt text is read back
+    from the DocumentStore at search time, one span at a time.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._chunks = {}
+        self._documents = {}
+        self._postings = {}
+        self._total_length = 0
+        self._next_id = 0
+        # Per document loaded in parts: (title, parts so far, start, text) of the chunk still open at its end
+        self._tails = {}
+
+    def __contains__(self, filename):
+        return filename in self._documents
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def add_document(self, filename, text):
+        if filename in self._documents:
+            self.remove_document(filename)
+        self.extend_document(filename, text)
+
+    def extend_document(self, filename, text, offset=0):
+        """
+        Index text that continues a document at character offset, for documents loaded in parts.
+
+        The last chunk of each part is indexed again together with the next
+        one, and section titles and part numbers carry over, so a document
+        is chunked the same as if it had been indexed at once.
+        """
+        chunk_ids = self._documents.setdefault(filename, [])
+        title, parts = None, 0
+        tail = self._tails.pop(filename, None)
+        if tail is not None:
+            title, parts, offset, tail_text = tail
+            if tail_text.strip():
+                # The open chunk was indexed as the document's last
+                self._remove_chunk(chunk_ids.pop())
+            text = tail_text + text
+
+        spans, (open_title, open_start) = _chunk_spans(text, MAX_CHUNK_CHARS, title)
+        open_text = text[open_start:]
+        self._tails[filename] = (open_title, parts + len(spans) - (1 if open_text.strip() else 0), offset + open_start, open_text)
+        for number, (section, start, end) in enumerate(spans, start=parts + 1):
+            section = section or f"Part {number}"
+            term_counts = Counter(tokenize(f"{section}\n{text[start:end]}"))
+            chunk = Chunk(filename, section, offset + start, offset + end, term_counts)
+            chunk_id = self._next_id
+            self._next_id += 1
+
+            self._chunks[chunk_id] = chunk
+            self._total_length += chunk.length
+            for term, count in term_counts.items():
+                self._postings.setdefault(term, {})[chunk_id] = count
+            chunk_ids.append(chunk_id)
+
+    def remove_document(self, filename):
+        self._tails.pop(filename, None)
+        for chunk_id in self._documents.pop(filename, []):
+            self._remove_chunk(chunk_id)
+
+    def _remove_chunk(self, chunk_id):
+        chunk = self._chunks.pop(chunk_id)
+        self._total_length -= chunk.length
+        for term in chunk.terms:
+            postings = self._postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self._postings[term]
+
+    def clear(self):
+        self.__init__(self.k1, self.b)
+
+    def search(self, query, documents, k=DEFAULT_TOP_K):
+        """Return up to k excerpts from documents ranked by BM25 score for the query."""
+        if not self._chunks:
+            return []
+
+        total_chunks = len(self._chunks)
+        average_length = self._total_length / total_chunks or 1
+        scores = {}
+
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, count in postings.items():
+                length_norm = 1 - self.b + self.b * self._chunks[chunk_id].length / average_length
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+
+        if not scores:
+            # Nothing matched (e.g. "summarize this"), so fall back to the opening of each file
+            ranked = [ids[i] for i in range(k) for ids in self._documents.values() if i < len(ids)][:k]
+        else:
+            ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+
+        # Only the retrieved spans are read from the DocumentStore, not whole documents
+        excerpts = []
+        for chunk_id in ranked:
+            chunk = self._chunks[chunk_id]
+            excerpts.append(Excerpt(chunk.filename, chunk.section, documents.read(chunk.filename, chunk.start, chunk.end).strip()))
+        return excerpts
+
@@ -0,0 +1,61 @@
+"""
+Background pre-warming of the dependencies the app loads on first use
+"""
+
+import os
+import threading
+import metrics
+
+# Set to 0 to load everything on first use only, e.g. for short-lived test processes
+PREWARM = os.environ.get("INDIEAPP_PREWARM", "1") != "0"
+
+_started = False
+_lock = threading.Lock()
+
+
+def _load_openai():
+    from openai import AzureOpenAI, AsyncAzureOpenAI
+
+
+def _load_tokenizer():
+    from context import get_encoding
+    get_encoding()
+
+
+def _start_converters():
+    from conversion import warm_workers
+    warm_workers()
+
+
+# In the order a new session is most likely to need them
+STEPS = [
+    ("openai", _load_openai),
+    ("tokenizer", _load_tokenizer),
+    ("converters", _start_converters),
+]
+
+
+def _warm():
+    for name, step in STEPS:
+        try:
+            with metrics.timed("startup", name):
+                step()
+        except Exception:
+            # Pre-warming is best effort; first use reports its own errors
+            pass
+
+
+def prewarm():
+    """
+    Load the OpenAI SDK, the tokenizer and the conversion processes in a background thread.
+
+    Called on every script run; only the first call in the process does anything.
+    """
+    global _started
+    if not PREWARM:
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_warm, name="prewarm", daemon=True).start()
@@ -0,0 +1,32 @@
+import time
+
+from doc_store import DocumentStore
+
+
+def test_empty_document_does_not_stop_spilling():
+    store = DocumentStore(budget_bytes=100)
+    store["empty.pdf"] = ""
+    time.sleep(0.01)
+    store["a.md"] = "a" * 80
+    time.sleep(0.01)
+    store["b.md"] = "b" * 80
+
+    assert store.memory_usage() <= 100
+    assert store["a.md"] == "a" * 80
+    assert store["b.md"] == "b" * 80
+
+
+def test_empty_documents_read_back():
+    store = DocumentStore(budget_bytes=100)
+    store["empty.pdf"] = ""
+    store["a.md"] = "a" * 80
+    store["b.md"] = "b" * 80
+    # A document created empty and streamed into is spilled with an empty first part
+    store["streamed.csv"] = ""
+    store.append("streamed.csv", "")
+
+    assert store["empty.pdf"] == ""
+    assert store.read("empty.pdf") == ""
+    assert store["streamed.csv"] == ""
+    assert "".join(store.parts("streamed.csv")) == ""
+    assert store.size("streamed.csv") == (0, 0)
@@ -0,0 +1,20 @@
+from retrieval import RetrievalIndex
+
+
+def _spans(index, filename):
+    return [(chunk.section, chunk.start, chunk.end) for chunk in (index._chunks[i] for i in index._documents[filename])]
+
+
+def test_document_indexed_in_parts_matches_whole():
+    text = "".join(
+        f"## Sheet{sheet}\n| a | b |\n| --- | --- |\n" + "".join(f"| {sheet} | row {row} |\n" for row in range(1500))
+        for sheet in (1, 2)
+    ) + "<!-- Page number: 3 -->\nlast page\n"
+    whole = RetrievalIndex()
+    whole.add_document("book.xlsx", text)
+
+    for size in (1000, 4096, 65536):
+        parts = RetrievalIndex()
+        for offset in range(0, len(text), size):
+            parts.extend_document("book.xlsx", text[offset:offset + size], offset)
+        assert _spans(parts, "book.xlsx") == _spans(whole, "book.xlsx")